@@ -1,182 +1,1268 @@
-from flask import Flask, render_template, request, send_file, jsonify, make_response
-from PIL import Image, ImageDraw, ImageFont
+from flask import Flask, render_template, request, send_file, jsonify, make_response, Response, stream_with_context, g, url_for
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
 import io
+import importlib.util
 import base64
-from reportlab.pdfgen import canvas as pdf_canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.colors import Color
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
+import hashlib
+import json
 import os
+import re
+import time
+import math
+import uuid
+import queue
+import itertools
+import multiprocessing
+import mmap
+import shutil
+import tempfile
+import csv
+import struct
+import sqlite3
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
+from werkzeug.utils import secure_filename
+
+# Optional: subsetting webfonts needs fontTools, and WOFF2 also needs brotli
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+try:
+    import brotli  # noqa: F401 -- used by fontTools for WOFF2
+    WEBFONT_FLAVOR = 'woff2'
+except ImportError:
+    WEBFONT_FLAVOR = 'woff'
+# Optional: vector PDFs of Urdu need ReportLab's HarfBuzz shaping and bidi reordering
+PDF_TEXT_SHAPING = all(importlib.util.find_spec(name) for name in ('uharfbuzz', 'rlbidi'))
 
 app = Flask(__name__)
 
-# Create necessary directories
-os.makedirs('static/fonts', exist_ok=True)
-os.makedirs('static/css', exist_ok=True)
-os.makedirs('static/js', exist_ok=True)
-os.makedirs('templates', exist_ok=True)
-os.makedirs('exports', exist_ok=True)
+# Process start, reset per worker by mark_worker_started() after a preload fork
+STARTED_AT = time.time()
+
+# Convert mm to points (1 mm = 2.834645669 points)
+MM_TO_POINTS = 2.834645669
+# Same values as reportlab.lib.pagesizes, which is imported lazily
+PAGE_SIZES = {'A4': (595.2755905511812, 841.8897637795277), 'Letter': (612.0, 792.0)}
+
+# ReportLab is imported on first PDF use (see load_reportlab); previews never need it
+pdf_canvas = Color = ImageReader = TTFont = pdfmetrics = bidiShapedText = None
+_reportlab_lock = threading.Lock()
+
+def load_reportlab():
+    """Import ReportLab into module globals on first use"""
+    global pdf_canvas, Color, ImageReader, TTFont, pdfmetrics, bidiShapedText
+    if pdf_canvas is not None:
+        return
+    with _reportlab_lock:
+        if pdf_canvas is not None:
+            return
+        from reportlab.lib.colors import Color
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfgen.textobject import bidiShapedText
+        from reportlab import rl_config
+        
+        # Write binary PDF streams; ASCII85 inflates embedded images by a quarter
+        rl_config.useA85 = 0
+        
+        # Assigned last: it is the flag other threads check
+        from reportlab.pdfgen import canvas as pdf_canvas
+
+FONT_DIR = os.environ.get('FONT_DIR', 'static/fonts')
+FONT_CACHE_SIZE = int(os.environ.get('FONT_CACHE_SIZE', 64))
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', 64 * 1024 * 1024))
+# Render cache on local disk shared by all worker processes; empty disables it
+DISK_CACHE_DIR = os.environ.get('DISK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'urdu-card-cache'))
+DISK_CACHE_BYTES = int(os.environ.get('DISK_CACHE_BYTES', 512 * 1024 * 1024))
+# Generated webfont subsets, shared by all workers
+WEBFONT_DIR = os.environ.get('WEBFONT_DIR', os.path.join(tempfile.gettempdir(), 'urdu-card-webfonts'))
+LAYOUT_CACHE_BYTES = int(os.environ.get('LAYOUT_CACHE_BYTES', 32 * 1024 * 1024))
+LAYOUT_EXTENT_ENTRIES = int(os.environ.get('LAYOUT_EXTENT_ENTRIES', 65536))
+# Auto-fit measures at one DPI so previews and exports pick the same size
+AUTO_FIT_DPI = int(os.environ.get('AUTO_FIT_DPI', 300))
+AUTO_FIT_MAX_SIZE = int(os.environ.get('AUTO_FIT_MAX_SIZE', 400))
+# Padding in mm for auto-fit cards that set none, so it scales with the DPI
+AUTO_FIT_PADDING = float(os.environ.get('AUTO_FIT_PADDING', 3))
+# Cards above this many pixels are rendered in horizontal strips
+TILED_RENDER_PIXELS = int(os.environ.get('TILED_RENDER_PIXELS', 16 * 1024 * 1024))
+TILE_STRIP_HEIGHT = int(os.environ.get('TILE_STRIP_HEIGHT', 512))
+# Backing directory for tiled frames; keep it off tmpfs so the frame is reclaimable
+TILE_DIR = os.environ.get('TILE_DIR') or ('/var/tmp' if os.path.isdir('/var/tmp') else None)
+# Preview encoder effort: PNG compress_level / WebP method (lower is faster)
+PREVIEW_EFFORT = int(os.environ.get('PREVIEW_EFFORT', 1))
+PREVIEW_WEBP_QUALITY = int(os.environ.get('PREVIEW_WEBP_QUALITY', 80))
+PREVIEW_DPI = int(os.environ.get('PREVIEW_DPI', 150))
+PREVIEW_DRAFT_MAX_DPI = int(os.environ.get('PREVIEW_DRAFT_MAX_DPI', 72))
+PREVIEW_DRAFT_MIN_DPI = int(os.environ.get('PREVIEW_DRAFT_MIN_DPI', 24))
+PREVIEW_FORMATS = {'webp': 'image/webp', 'png': 'image/png', 'palette': 'image/png'}
+# Ceiling on the render memory in flight in one worker process
+RENDER_BUDGET_BYTES = int(os.environ.get('RENDER_BUDGET_BYTES', 1024 * 1024 * 1024))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_ADMISSION_TIMEOUT = float(os.environ.get('JOB_ADMISSION_TIMEOUT', 300))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 600))
+JOB_RESULT_BYTES = int(os.environ.get('JOB_RESULT_BYTES', 512 * 1024 * 1024))
+# Job records and results, shared by all worker processes
+JOB_STORE_DIR = os.environ.get('JOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'urdu-card-jobs'))
+SCENE_MAX_ELEMENTS = int(os.environ.get('SCENE_MAX_ELEMENTS', 200))
+SCENE_MAX_TEXT_LENGTH = int(os.environ.get('SCENE_MAX_TEXT_LENGTH', 5000))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_CARDS = int(os.environ.get('BATCH_MAX_CARDS', 1000))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', BATCH_WORKERS))
+# Gunicorn kills a sync worker whose request runs past this (see gunicorn.conf.py)
+WORKER_TIMEOUT = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+# Streamed exports stop rendering after this long, so the ZIP is still finished in time
+SYNC_EXPORT_SECONDS = float(os.environ.get('SYNC_EXPORT_SECONDS', WORKER_TIMEOUT * 0.8))
+# Seconds a single batch card may render before its worker is killed
+BATCH_CARD_TIMEOUT = min(float(os.environ.get('BATCH_CARD_TIMEOUT', 120)), SYNC_EXPORT_SECONDS)
+# Batch workers must not fork from a threaded web worker (held locks are copied)
+BATCH_START_METHOD = os.environ.get('BATCH_START_METHOD') or (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Archival of exported files to disk is opt-in
+EXPORT_ARCHIVE = os.environ.get('EXPORT_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+EXPORT_RETENTION_HOURS = float(os.environ.get('EXPORT_RETENTION_HOURS', 24))
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', 512 * 1024 * 1024))
+
+class Metrics:
+    """In-process counters and histograms rendered as Prometheus text"""
+
+    SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
 
-class UrduCardGenerator:
     def __init__(self):
-        self.default_fonts = [
-            'Noto Nastaliq Urdu',
-            'Jameel Noori Nastaleeq',
-            'Alvi Nastaleeq',
-            'Nafees Web Naskh'
-        ]
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, help_text, labels=None, value=1):
+        key = self._labels(labels)
+        with self._lock:
+            self._help[name] = ('counter', help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, help_text, value, labels=None, buckets=SECONDS_BUCKETS):
+        key = self._labels(labels)
+        with self._lock:
+            self._help[name] = ('histogram', help_text)
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of all series plus the given gauges"""
+        out = []
+        with self._lock:
+            for name in sorted(self._counters):
+                out.append(f"# HELP {name} {self._help[name][1]}")
+                out.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    out.append(f"{name}{self._format_labels(labels)} {value}")
+            for name in sorted(self._histograms):
+                out.append(f"# HELP {name} {self._help[name][1]}")
+                out.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(hist['buckets'], hist['counts']):
+                        cumulative += count
+                        out.append(f"{name}_bucket{self._format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                    out.append(f"{name}_bucket{self._format_labels(labels, ('le', '+Inf'))} {hist['count']}")
+                    out.append(f"{name}_sum{self._format_labels(labels)} {hist['sum']:.6f}")
+                    out.append(f"{name}_count{self._format_labels(labels)} {hist['count']}")
+        for name, (help_text, series) in sorted((gauges or {}).items()):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} gauge")
+            for labels, value in series:
+                out.append(f"{name}{self._format_labels(self._labels(labels))} {value}")
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+
+# Stage timings of the request being handled by this thread
+_request_timings = threading.local()
+
+@contextmanager
+def timed(stage):
+    """Time a render stage into the stage histogram and the Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('urdu_card_stage_seconds', 'Time spent in each render stage.',
+                        elapsed, {'stage': stage})
+        stages = getattr(_request_timings, 'stages', None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+# Letters used to score a font's script coverage in the catalog
+URDU_LETTERS = 'ابپتٹثجچحخدڈذرڑزژسشصضطظعغفقکگلمنںوہھءیے'
+ARABIC_LETTERS = ''.join(chr(code) for code in range(0x0621, 0x064B))
+# Text in these blocks is laid out right to left
+RTL_PATTERN = re.compile('[\u0590-\u08FF\uFB1D-\uFDFF\uFE70-\uFEFF]')
+
+def read_font_info(font_path):
+    """Return (weight class, letters of URDU_LETTERS + ARABIC_LETTERS with a glyph)
     
-    def hex_to_rgb(self, hex_color):
-        """Convert hex color to RGB tuple"""
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    Reads the OS/2 and cmap tables of a TrueType/OpenType font directly
+    (the first face of a collection), so building the catalog needs neither
+    ReportLab nor a full font parse.
+    """
+    with open(font_path, 'rb') as f:
+        data = f.read()
+    ushort = lambda offset: struct.unpack_from('>H', data, offset)[0]
+    ulong = lambda offset: struct.unpack_from('>I', data, offset)[0]
+    
+    base = ulong(12) if data[:4] == b'ttcf' else 0
+    tables = {}
+    for i in range(ushort(base + 4)):
+        record = base + 12 + 16 * i
+        tables[data[record:record + 4]] = ulong(record + 8)
+    weight = ushort(tables[b'OS/2'] + 4) if b'OS/2' in tables else 400
+    
+    # Prefer a full Unicode (format 12) subtable, else a BMP (format 4) one
+    cmap = tables.get(b'cmap')
+    subtable = None
+    if cmap is not None:
+        candidates = []
+        for i in range(ushort(cmap + 2)):
+            platform, encoding = ushort(cmap + 4 + 8 * i), ushort(cmap + 6 + 8 * i)
+            offset = cmap + ulong(cmap + 8 + 8 * i)
+            if platform == 0 or (platform == 3 and encoding in (1, 10)):
+                candidates.append((ushort(offset), offset))
+        for fmt in (12, 4):
+            subtable = next((offset for f, offset in candidates if f == fmt), None)
+            if subtable is not None:
+                break
     
-    def get_font(self, font_family, font_size_px):
-        """Get font with fallback options"""
-        # Map font names to actual files
-        font_mapping = {
-            'Noto Nastaliq Urdu': 'NotoNastaliqUrdu.ttf',
-            'NotoNastaliqUrdu': 'NotoNastaliqUrdu.ttf',
+    def glyph(code):
+        if subtable is None:
+            return 0
+        if ushort(subtable) == 12:
+            for i in range(ulong(subtable + 12)):
+                start, end, start_glyph = struct.unpack_from('>III', data, subtable + 16 + 12 * i)
+                if start <= code <= end:
+                    return start_glyph + code - start
+            return 0
+        seg_x2 = ushort(subtable + 6)
+        ends = subtable + 14
+        starts = ends + seg_x2 + 2
+        deltas = starts + seg_x2
+        ranges = deltas + seg_x2
+        for i in range(seg_x2 // 2):
+            if ushort(ends + 2 * i) < code:
+                continue
+            start = ushort(starts + 2 * i)
+            if start > code:
+                return 0
+            delta = struct.unpack_from('>h', data, deltas + 2 * i)[0]
+            range_offset = ushort(ranges + 2 * i)
+            if range_offset == 0:
+                return (code + delta) & 0xFFFF
+            index = ushort(ranges + 2 * i + range_offset + 2 * (code - start))
+            return (index + delta) & 0xFFFF if index else 0
+        return 0
+    
+    return weight, {letter for letter in URDU_LETTERS + ARABIC_LETTERS if glyph(ord(letter))}
+
+class FontRegistry:
+    """Catalog of installed fonts plus a bounded LRU of loaded fonts
+    
+    The catalog is built once from the font directory (and any system
+    fallback fonts) and is the only source of font resolution for both the
+    Pillow and ReportLab paths. Each entry records the real family and
+    style names, weight class and Urdu/Arabic glyph coverage.
+    """
+
+    FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+    # System fonts added to the catalog when present
+    SYSTEM_FONT_PATHS = [
+        '/System/Library/Fonts/NotoNastaliqUrdu.ttc',
+        '/System/Library/Fonts/Helvetica.ttc',
+        '/System/Library/Fonts/Arial.ttf',
+    ]
+
+    def __init__(self, font_dir=FONT_DIR, max_fonts=FONT_CACHE_SIZE):
+        self.font_dir = font_dir
+        self.max_fonts = max(1, max_fonts)
+        self._lock = threading.Lock()
+        self._entries = []
+        self._aliases = {}
+        self._families = {}
+        self._fonts = OrderedDict()
+        self._dir_mtime = None
+        self.fallback_path = None
+        self.fingerprint = ''
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scan()
+
+    @staticmethod
+    def normalize(name):
+        """Normalize a family name or file stem for alias lookup"""
+        return ''.join(ch for ch in name.lower() if ch not in ' -_')
+
+    def describe(self, font_path, source):
+        """Catalog entry for one font file, or None if it cannot be loaded"""
+        try:
+            family, style = ImageFont.truetype(font_path, 12).getname()
+        except Exception as e:
+            print(f"Skipping unreadable font {font_path}: {e}")
+            return None
+        try:
+            weight, covered = read_font_info(font_path)
+        except (struct.error, KeyError, OSError) as e:
+            print(f"Could not read font tables of {font_path}: {e}")
+            weight, covered = 400, set()
+        style = style or 'Regular'
+        return {
+            'family': family,
+            'style': style,
+            'weight': weight,
+            'italic': 'italic' in style.lower() or 'oblique' in style.lower(),
+            'file': os.path.basename(font_path),
+            'path': font_path,
+            'source': source,
+            'urdu': round(len(covered & set(URDU_LETTERS)) / len(URDU_LETTERS), 2),
+            'arabic': round(len(covered & set(ARABIC_LETTERS)) / len(ARABIC_LETTERS), 2),
         }
+
+    def scan(self):
+        """Build the catalog and index it by family, family + style and file stem"""
+        files = []
+        dir_mtime = None
+        if os.path.isdir(self.font_dir):
+            dir_mtime = os.stat(self.font_dir).st_mtime_ns
+            for file in sorted(os.listdir(self.font_dir)):
+                if os.path.splitext(file)[1].lower() in self.FONT_EXTENSIONS:
+                    files.append((os.path.join(self.font_dir, file), 'bundled'))
+        files += [(path, 'system') for path in self.SYSTEM_FONT_PATHS if os.path.exists(path)]
+
+        entries = [entry for entry in (self.describe(path, source) for path, source in files) if entry]
+        aliases = {}
+        families = {}
+        for entry in entries:
+            stem = os.path.splitext(entry['file'])[0]
+            for alias in (f"{entry['family']} {entry['style']}", stem):
+                aliases.setdefault(self.normalize(alias), entry)
+            for family in (entry['family'], stem.rsplit('-', 1)[0]):
+                families.setdefault(self.normalize(family), []).append(entry)
+
+        # Unknown families fall back to the font that best covers Urdu
+        fallback = max(entries, key=lambda entry: (entry['urdu'], entry['source'] == 'bundled',
+                                                   not entry['italic'], -abs(entry['weight'] - 400)),
+                       default=None)
+
+        # Identifies this set of font files, so renders cached on disk by an
+        # earlier deploy are not served after fonts change
+        digest = hashlib.sha256()
+        for entry in entries:
+            stat = os.stat(entry['path'])
+            digest.update(f"{entry['path']}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+
+        with self._lock:
+            self._entries = entries
+            self._aliases = aliases
+            self._families = families
+            self._dir_mtime = dir_mtime
+            self.fallback_path = fallback['path'] if fallback else None
+            self.fingerprint = digest.hexdigest()[:16]
+
+    def changed(self):
+        """Whether fonts were added, removed or renamed since the last scan"""
+        try:
+            dir_mtime = os.stat(self.font_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        return dir_mtime != self._dir_mtime
+
+    def resolve(self, font_family, weight=None, italic=False):
+        """Return the font file for a family or alias
         
-        # Try mapped font name first
-        if font_family in font_mapping:
-            font_filename = font_mapping[font_family]
-            font_path = f"static/fonts/{font_filename}"
-            if os.path.exists(font_path):
-                try:
-                    return ImageFont.truetype(font_path, font_size_px)
-                except Exception as e:
-                    print(f"Error loading mapped font {font_path}: {e}")
-        
-        # Try multiple font paths and extensions
-        font_paths = [
-            f"static/fonts/{font_family}.ttf",
-            f"static/fonts/{font_family}.otf",
-            f"static/fonts/{font_family.replace(' ', '')}.ttf",
-            f"static/fonts/{font_family.replace(' ', '')}.otf",
-            f"static/fonts/{font_family.replace(' ', '').replace('-', '')}.ttf",
-        ]
-        
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    return ImageFont.truetype(font_path, font_size_px)
-                except Exception as e:
-                    print(f"Error loading font {font_path}: {e}")
-                    continue
+        Within a family the requested style (upright unless italic) wins,
+        then the nearest weight (default 400).
+        """
+        if not font_family:
+            return None
+        key = self.normalize(font_family)
+        candidates = self._families.get(key)
+        if candidates:
+            target = 400 if weight is None else weight
+            return min(candidates, key=lambda entry: (entry['italic'] != italic,
+                                                      abs(entry['weight'] - target)))['path']
+        entry = self._aliases.get(key)
+        return entry['path'] if entry else None
+
+    def catalog(self):
+        """Public catalog entries (without server paths), sorted by family and weight"""
+        with self._lock:
+            entries = list(self._entries)
+        return [{k: v for k, v in entry.items() if k != 'path'}
+                for entry in sorted(entries, key=lambda entry: (entry['family'], entry['weight']))]
+
+    def entries(self):
+        """Catalog entries including their font file paths"""
+        with self._lock:
+            return list(self._entries)
+
+    def font_paths(self):
+        """Distinct catalog font files"""
+        return sorted({entry['path'] for entry in self._entries})
+
+    def load(self, font_path, font_size_px):
+        """Return a cached FreeTypeFont for (font_path, font_size_px)"""
+        key = (font_path, font_size_px)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(font_path, font_size_px)
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+        return font
+
+    def invalidate(self):
+        """Drop loaded fonts and rescan the font directory"""
+        with self._lock:
+            self._fonts.clear()
+        self.scan()
+
+    def stats(self):
+        """Cache counters for monitoring"""
+        with self._lock:
+            return {
+                'fonts': len(self._entries),
+                'families': len({entry['family'] for entry in self._entries}),
+                'loaded': len(self._fonts),
+                'capacity': self.max_fonts,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+font_registry = FontRegistry()
+
+class LayoutCache:
+    """Bounded LRU of shaped and rasterized lines keyed by (font, size, text, direction)
+    
+    Each entry holds the line's glyph mask and bounding box, so measuring a
+    line and drawing it share a single shaping pass. measure() keeps a
+    separate, count-bounded table of bounding boxes for lines that are only
+    measured, such as the candidate lines of auto-fit.
+    """
+
+    def __init__(self, max_bytes=LAYOUT_CACHE_BYTES, max_extents=LAYOUT_EXTENT_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_extents = max_extents
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._extents = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, font, text, direction=None):
+        """Return {'mask', 'bbox'} for text, or None for fonts that cannot be cached"""
+        if not isinstance(font, ImageFont.FreeTypeFont):
+            return None
         
-        # Try system fonts for common Urdu fonts
-        system_font_paths = [
-            '/System/Library/Fonts/NotoNastaliqUrdu.ttc',
-            '/System/Library/Fonts/Helvetica.ttc',
-            '/System/Library/Fonts/Arial.ttf',
-        ]
+        key = (font.path, font.size, text, direction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
         
-        for sys_font in system_font_paths:
+        core, offset = font.getmask2(text, 'L', direction=direction)
+        mask = Image.Image()._new(core)
+        entry = {
+            'mask': mask,
+            'bbox': (offset[0], offset[1], offset[0] + mask.width, offset[1] + mask.height),
+        }
+        nbytes = mask.width * mask.height
+        
+        with self._lock:
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = entry
+                self.size_bytes += nbytes
+                while self.size_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size_bytes -= evicted['mask'].width * evicted['mask'].height
+                    self.evictions += 1
+        return entry
+
+    def measure(self, font, text, direction=None):
+        """Bounding box of text without rasterizing it, memoized by (font, size, text, direction)
+        
+        Lines that were already shaped for drawing answer from their entry.
+        """
+        if not isinstance(font, ImageFont.FreeTypeFont):
+            return font.getbbox(text)
+        
+        key = (font.path, font.size, text, direction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry['bbox']
+            bbox = self._extents.get(key)
+            if bbox is not None:
+                self._extents.move_to_end(key)
+                self.hits += 1
+                return bbox
+            self.misses += 1
+        
+        bbox = font.getbbox(text, direction=direction)
+        with self._lock:
+            self._extents[key] = bbox
+            while len(self._extents) > self.max_extents:
+                self._extents.popitem(last=False)
+        return bbox
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._extents.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'extents': len(self._extents),
+                'bytes': self.size_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+layout_cache = LayoutCache()
+
+class PdfFontCache:
+    """Registers each font file with ReportLab once per process
+    
+    Subsetting policy: TrueType outlines are always embedded as subsets
+    holding only the glyphs a document draws (ReportLab's TTF embedding).
+    Fonts ReportLab cannot subset, such as CFF-flavoured OTF, are never
+    embedded whole; Helvetica is used for them instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+        self.registrations = 0
+        self.failures = 0
+
+    def register(self, font_path):
+        """Return the ReportLab font name for font_path, or None if unusable"""
+        load_reportlab()
+        with self._lock:
+            if font_path in self._names:
+                return self._names[font_path]
+            
+            # Files with the same stem in different directories must not share a name
+            path_hash = hashlib.sha256(os.path.abspath(font_path).encode('utf-8')).hexdigest()[:8]
+            font_name = f"{os.path.splitext(os.path.basename(font_path))[0]}-{path_hash}"
             try:
-                if os.path.exists(sys_font):
-                    return ImageFont.truetype(sys_font, font_size_px)
+                pdfmetrics.registerFont(TTFont(font_name, font_path))
+                self.registrations += 1
             except Exception as e:
-                print(f"Error loading system font {sys_font}: {e}")
-                continue
+                print(f"Font registration error for {font_path}: {e}")
+                font_name = None
+                self.failures += 1
+            # Failures are cached too so a bad file is only parsed once
+            self._names[font_path] = font_name
+            return font_name
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'registered': sum(1 for name in self._names.values() if name),
+                'registrations': self.registrations,
+                'failures': self.failures,
+            }
+
+pdf_fonts = PdfFontCache()
+
+class ExportArchive:
+    """Optional on-disk copy of exports with age and total-size limits"""
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, export_dir=EXPORT_DIR, enabled=EXPORT_ARCHIVE,
+                 retention_hours=EXPORT_RETENTION_HOURS, max_bytes=EXPORT_MAX_BYTES):
+        self.export_dir = export_dir
+        self.enabled = enabled
+        self.retention_seconds = retention_hours * 3600
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+
+    def save(self, data, filename):
+        """Write data under a unique name, returning the path (or None if disabled)"""
+        if not self.enabled:
+            return None
         
-        # Fallback to default font with appropriate size
+        os.makedirs(self.export_dir, exist_ok=True)
+        stem, ext = os.path.splitext(filename)
+        filepath = os.path.join(self.export_dir, f"{stem}_{uuid.uuid4().hex[:8]}{ext}")
+        
+        # Write to a temporary name first so readers never see partial files
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+        
+        if time.time() - self._last_sweep > self.SWEEP_INTERVAL:
+            self.sweep()
+        return filepath
+
+    def sweep(self):
+        """Delete archived files past retention, then oldest-first down to the size cap"""
+        with self._lock:
+            self._last_sweep = time.time()
+            if not os.path.isdir(self.export_dir):
+                return
+            
+            entries = []
+            for entry in os.scandir(self.export_dir):
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort()
+            
+            cutoff = self._last_sweep - self.retention_seconds
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if mtime >= cutoff and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    print(f"Error removing archived export {path}: {e}")
+
+export_archive = ExportArchive()
+
+# Embedded font programs are the only streams ReportLab writes with /Length1
+_FONT_STREAM_RE = re.compile(rb'/Length (\d+) /Length1 \d+')
+
+def embedded_font_bytes(pdf_bytes):
+    """Total size of the font programs embedded in a PDF document"""
+    return sum(int(length) for length in _FONT_STREAM_RE.findall(pdf_bytes))
+
+class DiskCache:
+    """Content-addressed blob store in SQLite, shared by all worker processes
+    
+    Each write is a single transaction, so readers in other processes see a
+    whole entry or none. Total size is kept under max_bytes by evicting the
+    least recently used entries. Errors are logged and treated as misses:
+    the cache never fails a request.
+    """
+
+    # Access times are only rewritten when older than this, to keep hits read-only
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, cache_dir=DISK_CACHE_DIR, max_bytes=DISK_CACHE_BYTES):
+        self.path = os.path.join(cache_dir, 'renders.sqlite3')
+        self.max_bytes = max_bytes
+        # Larger renders would push out many smaller, more useful entries
+        self.max_entry_bytes = max_bytes // 8
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connect(self):
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                     'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _error(self, action, e):
+        self._count('errors')
+        print(f"Disk cache {action} error: {e}")
+
+    def get(self, key):
         try:
-            # For newer Pillow versions, try to create a default font with size
-            return ImageFont.load_default()
-        except:
-            # Last resort - create a basic font
-            return ImageFont.load_default()
+            conn = self._connect()
+            row = conn.execute('SELECT data, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            now = time.time()
+            if row[1] < now - self.TOUCH_INTERVAL:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self._count('hits')
+            return bytes(row[0])
+        except sqlite3.Error as e:
+            self._error('read', e)
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_entry_bytes:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT OR REPLACE INTO entries (key, data, size, accessed) VALUES (?, ?, ?, ?)',
+                             (key, sqlite3.Binary(data), len(data), time.time()))
+                self._evict(conn)
+            self._count('writes')
+        except sqlite3.Error as e:
+            self._error('write', e)
+
+    def _evict(self, conn):
+        """Delete least recently used entries until the total fits (inside the write transaction)"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+        self._count('evictions', len(victims))
+
+    def stats(self):
+        """Shared entry counts plus this process's hit/miss counters"""
+        entries, size = 0, 0
+        try:
+            entries, size = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except sqlite3.Error as e:
+            self._error('stats', e)
+        with self._stats_lock:
+            return {
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'errors': self.errors,
+            }
+
+class RenderCache:
+    """Size-bounded LRU of encoded renders keyed by a content hash
     
-    def create_card_image(self, text, width, height, font_size, font_color, bg_color, 
-                         alignment, line_spacing, font_family, dpi=300):
-        """Create high-quality card image with improved text rendering"""
+    An optional DiskCache behind the in-memory LRU shares renders between
+    worker processes; disk hits are promoted into memory.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_BYTES, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(kind, params):
+        """Canonical hash of an output kind and its normalized parameters"""
+        payload = json.dumps({'kind': kind, 'params': params, 'fonts': font_registry.fingerprint}, sort_keys=True,
+                             ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        
+        if self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        self._store(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def _store(self, key, data):
+        # Entries larger than the whole cache are never stored
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old)
+            self._entries[key] = data
+            self.size_bytes += len(data)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_render(self, key, render, flight=None):
+        """Return cached bytes for key, calling render() on a miss
+        
+        With a flight such as single_flight, concurrent misses share one
+        render and only its leader stores the result.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+        
+        def render_and_store():
+            data = render()
+            self.put(key, data)
+            return data
+        
+        return render_and_store() if flight is None else flight(key, render_and_store)
+
+    def clear(self):
+        """Empty this process's LRU; the shared disk cache evicts by size on its own"""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+render_cache = RenderCache(disk=DiskCache() if DISK_CACHE_DIR else None)
+
+class AdmissionRejected(Exception):
+    """Raised when a render does not fit in the per-process memory budget"""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-process budget of estimated render memory in flight
+    
+    Every render route estimates its pixel memory up front and either gets
+    admitted, waits for capacity (queue), is told how far to lower its DPI
+    (downscale), or is rejected.
+    """
+
+    def __init__(self, max_bytes=RENDER_BUDGET_BYTES, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self.in_flight = 0
+        self.active = 0
+
+    def record(self, route, decision):
+        metrics.inc('urdu_card_admission_total', 'Render admission decisions by route.',
+                    {'route': route, 'decision': decision})
+
+    def available(self):
+        with self._lock:
+            return self.max_bytes - self.in_flight
+
+    def fit_dpi(self, route, nbytes_at_dpi, dpi, min_dpi=36):
+        """Largest DPI whose estimate fits the free budget (pixel memory scales with dpi²)"""
+        free = max(0, self.available())
+        if nbytes_at_dpi <= free:
+            return dpi
+        scaled = max(min_dpi, int(dpi * math.sqrt(free / nbytes_at_dpi)))
+        self.record(route, 'downscaled')
+        return scaled
+
+    @contextmanager
+    def admit(self, route, nbytes, timeout=None):
+        """Hold nbytes of the budget for the duration of the block"""
+        if nbytes > self.max_bytes:
+            self.record(route, 'rejected')
+            raise AdmissionRejected(
+                f'Request needs about {nbytes // (1024 * 1024)} MB, over the '
+                f'{self.max_bytes // (1024 * 1024)} MB render limit; reduce the size or DPI', status=413)
+        
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._lock:
+            if self.in_flight + nbytes > self.max_bytes:
+                self.record(route, 'queued')
+                # An idle worker always admits, so a single large request cannot starve
+                if not self._released.wait_for(
+                        lambda: self.active == 0 or self.in_flight + nbytes <= self.max_bytes,
+                        timeout=timeout):
+                    self.record(route, 'rejected')
+                    raise AdmissionRejected('Server is busy rendering, please retry shortly',
+                                            retry_after=max(1, int(timeout)))
+            self.in_flight += nbytes
+            self.active += 1
+        self.record(route, 'admitted')
         try:
-            # Convert dimensions to pixels for high DPI (mm to pixels)
-            img_width = int(width * dpi / 25.4)  # mm to inches to pixels
-            img_height = int(height * dpi / 25.4)
-            font_size_px = int(font_size * dpi / 72)  # points to pixels
-            line_spacing_px = int(line_spacing * dpi / 72)
-            
-            # Ensure minimum dimensions
-            img_width = max(img_width, 200)
-            img_height = max(img_height, 100)
-            font_size_px = max(font_size_px, 12)
-            
-            # Convert colors
-            bg_rgb = self.hex_to_rgb(bg_color)
-            font_rgb = self.hex_to_rgb(font_color)
-            
-            # Create image with high DPI
-            img = Image.new('RGB', (img_width, img_height), bg_rgb)
-            draw = ImageDraw.Draw(img)
-            
-            # Get font
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= nbytes
+                self.active -= 1
+                self._released.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight_bytes': self.in_flight, 'active': self.active,
+                    'max_bytes': self.max_bytes}
+
+admission = AdmissionController()
+
+def admission_response(error):
+    """JSON error response for a rejected render"""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.status_code = error.status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+class UrduCardGenerator:
+    def __init__(self):
+        # Renders in progress, keyed by render cache key
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+    
+    def single_flight(self, key, render):
+        """Run render() once for concurrent callers with the same key; the rest wait for its result"""
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        
+        if not leader:
+            metrics.inc('urdu_card_coalesced_total', 'Renders merged into an identical in-flight render.')
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        
+        try:
+            call['result'] = render()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call['done'].set()
+    
+    def hex_to_rgb(self, hex_color):
+        """Convert hex color to RGB tuple"""
+        hex_color = hex_color.lstrip('#')
+        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    
+    def get_font(self, font_family, font_size_px, weight=None):
+        """Get a catalog font, falling back to the catalog's best Urdu font"""
+        font_path = font_registry.resolve(font_family, weight) or font_registry.fallback_path
+        if font_path:
+            try:
+                return font_registry.load(font_path, font_size_px)
+            except Exception as e:
+                print(f"Error loading font {font_path}: {e}")
+        
+        # Fallback to default font
+        return ImageFont.load_default()
+    
+    def padding_px(self, padding, dpi):
+        """Card padding in mm as pixels; None is the default 20 px inset"""
+        return 20 if padding is None else int(padding * dpi / 25.4)
+    
+    def layout_card(self, text, width, height, font_size, alignment, line_spacing,
+                    font_family, dpi=300, padding=None):
+        """Measure and position the lines of a card without drawing anything"""
+        # Convert dimensions to pixels for high DPI (mm to pixels)
+        img_width = int(width * dpi / 25.4)  # mm to inches to pixels
+        img_height = int(height * dpi / 25.4)
+        font_size_px = int(font_size * dpi / 72)  # points to pixels
+        line_spacing_px = int(line_spacing * dpi / 72)
+        
+        # Ensure minimum dimensions
+        img_width = max(img_width, 200)
+        img_height = max(img_height, 100)
+        font_size_px = max(font_size_px, 12)
+        padding_px = self.padding_px(padding, dpi)
+        
+        # Get font
+        with timed('font'):
             font = self.get_font(font_family, font_size_px)
-            
-            # Process text
-            if not text or not text.strip():
-                text = "نمونہ متن\nSample Text"
-            
-            lines = [line for line in text.split('\n') if line.strip()]
-            if not lines:
-                lines = ["نمونہ متن"]
-            
-            # Calculate text metrics
-            line_heights = []
-            line_widths = []
-            
+        
+        # Process text
+        if not text or not text.strip():
+            text = "نمونہ متن\nSample Text"
+        
+        lines = [line for line in text.split('\n') if line.strip()]
+        if not lines:
+            lines = ["نمونہ متن"]
+        
+        line_boxes = self.measure_lines(font, lines, font_size_px)
+        
+        return {
+            'width': img_width,
+            'height': img_height,
+            'font': font,
+            'font_size_px': font_size_px,
+            'line_spacing_px': line_spacing_px,
+            'padding_px': padding_px,
+            'placements': self.place_lines(lines, line_boxes, img_width, img_height,
+                                           font_size_px, alignment, line_spacing_px,
+                                           padding_px),
+        }
+    
+    def measure_lines(self, font, lines, font_size_px):
+        """Bounding boxes of lines, shaped through the layout cache"""
+        line_boxes = []
+        
+        with timed('measure'):
             for line in lines:
                 try:
-                    bbox = draw.textbbox((0, 0), line, font=font)
-                    width_px = bbox[2] - bbox[0]
-                    height_px = bbox[3] - bbox[1]
-                    line_widths.append(width_px)
-                    line_heights.append(height_px)
+                    shaped = layout_cache.get(font, line)
+                    line_boxes.append(shaped['bbox'] if shaped else font.getbbox(line))
                 except:
                     # Fallback measurement
-                    line_widths.append(len(line) * font_size_px * 0.6)
-                    line_heights.append(font_size_px)
+                    line_boxes.append((0, 0, len(line) * font_size_px * 0.6, font_size_px))
+        return line_boxes
+    
+    def place_lines(self, lines, line_boxes, img_width, img_height, font_size_px,
+                    alignment, line_spacing_px, padding=20):
+        """Position measured lines as (x, y, line, bbox), centered vertically as a block"""
+        # Calculate total text block height
+        line_heights = [bbox[3] - bbox[1] for bbox in line_boxes]
+        total_line_height = max(line_heights) if line_heights else font_size_px
+        total_text_height = len(lines) * total_line_height + (len(lines) - 1) * line_spacing_px
+        
+        # Calculate starting Y position for vertical centering
+        start_y = max(padding, (img_height - total_text_height) // 2)
+        
+        placements = []
+        for i, line in enumerate(lines):
+            line_width = line_boxes[i][2] - line_boxes[i][0]
             
-            # Calculate total text block height
-            total_line_height = max(line_heights) if line_heights else font_size_px
-            total_text_height = len(lines) * total_line_height + (len(lines) - 1) * line_spacing_px
+            # Calculate X position based on alignment
+            if alignment == 'center':
+                x = max(padding, (img_width - line_width) // 2)
+            elif alignment == 'right':
+                x = max(padding, img_width - line_width - padding)
+            else:  # left
+                x = padding
             
-            # Calculate starting Y position for vertical centering
-            start_y = max(20, (img_height - total_text_height) // 2)
+            y = start_y + i * (total_line_height + line_spacing_px)
             
-            # Draw each line
+            # Ensure text is within bounds
+            x = max(padding, min(x, img_width - padding))
+            y = max(padding // 2, min(y, img_height - total_line_height - padding // 2))
+            
+            placements.append((x, y, line, line_boxes[i]))
+        
+        return placements
+    
+    def wrap_lines(self, font, paragraphs, max_width):
+        """Greedily break paragraphs (lists of words) into lines no wider than max_width
+        
+        Returns the lines and their bounding boxes. A word wider than
+        max_width gets a line of its own.
+        """
+        lines = []
+        boxes = []
+        for words in paragraphs:
+            line = words[0]
+            bbox = layout_cache.measure(font, line)
+            for word in words[1:]:
+                candidate = f'{line} {word}'
+                candidate_bbox = layout_cache.measure(font, candidate)
+                if candidate_bbox[2] - candidate_bbox[0] <= max_width:
+                    line, bbox = candidate, candidate_bbox
+                else:
+                    lines.append(line)
+                    boxes.append(bbox)
+                    line, bbox = word, layout_cache.measure(font, word)
+            lines.append(line)
+            boxes.append(bbox)
+        return lines, boxes
+    
+    def fit_text(self, text, width, height, alignment, line_spacing, font_family,
+                 padding=AUTO_FIT_PADDING, min_size=4, max_size=AUTO_FIT_MAX_SIZE,
+                 dpi=AUTO_FIT_DPI):
+        """Return (font_size, wrapped text, fits) for the largest size whose ink stays inside the padding"""
+        # The card's true size; layout_card's minimum canvas would overstate small cards
+        img_width = int(width * dpi / 25.4)
+        img_height = int(height * dpi / 25.4)
+        padding_px = self.padding_px(padding, dpi)
+        max_width = img_width - 2 * padding_px
+        line_spacing_px = int(line_spacing * dpi / 72)
+        
+        if not text or not text.strip():
+            text = "نمونہ متن\nSample Text"
+        paragraphs = [line.split() for line in text.split('\n') if line.strip()]
+        
+        page_width = width * MM_TO_POINTS
+        page_height = height * MM_TO_POINTS
+        padding_pt = 20 if padding is None else padding * MM_TO_POINTS
+        load_reportlab()
+        pdf_font = self.register_pdf_font(font_family)
+        
+        def pdf_fits(font, font_size, font_size_px, lines, boxes):
+            # Ink above and below the baseline, from the raster boxes scaled to points
+            ascent = font.getmetrics()[0]
+            scale = font_size / font_size_px
             for i, line in enumerate(lines):
-                if line.strip():
-                    line_width = line_widths[i] if i < len(line_widths) else 0
-                    
-                    # Calculate X position based on alignment
-                    padding = 20
-                    if alignment == 'center':
-                        x = max(padding, (img_width - line_width) // 2)
-                    elif alignment == 'right':
-                        x = max(padding, img_width - line_width - padding)
-                    else:  # left
-                        x = padding
-                    
-                    y = start_y + i * (total_line_height + line_spacing_px)
-                    
-                    # Ensure text is within bounds
-                    x = max(padding, min(x, img_width - padding))
-                    y = max(10, min(y, img_height - total_line_height - 10))
-                    
-                    # Draw text with better rendering
-                    try:
-                        draw.text((x, y), line, font=font, fill=font_rgb)
-                    except Exception as e:
-                        print(f"Error drawing text: {e}")
-                        # Fallback: draw with basic font
-                        basic_font = ImageFont.load_default()
-                        draw.text((x, y), line, font=basic_font, fill=font_rgb)
+                text_width = pdfmetrics.stringWidth(line, pdf_font, font_size)
+                if text_width > page_width - 2 * padding_pt:
+                    return False
+                x, y = self.pdf_line_origin(i, len(lines), text_width, page_width, page_height,
+                                            font_size, alignment, line_spacing, padding_pt)
+                if (x + text_width > page_width or
+                        y + (ascent - boxes[i][1]) * scale > page_height - padding_pt or
+                        y - (boxes[i][3] - ascent) * scale < padding_pt):
+                    return False
+            return True
+        
+        def attempt(font_size):
+            font_size_px = max(int(font_size * dpi / 72), 12)
+            font = self.get_font(font_family, font_size_px)
+            lines, boxes = self.wrap_lines(font, paragraphs, max_width)
+            if any(bbox[2] - bbox[0] > max_width for bbox in boxes):
+                return lines, False
+            placements = self.place_lines(lines, boxes, img_width, img_height, font_size_px,
+                                          alignment, line_spacing_px, padding_px)
+            fits = all(x + bbox[0] >= 0 and x + bbox[2] <= img_width and
+                       y + bbox[1] >= padding_px and y + bbox[3] <= img_height - padding_px
+                       for x, y, line, bbox in placements)
+            return lines, fits and pdf_fits(font, font_size, font_size_px, lines, boxes)
+        
+        best = None
+        low, high = min_size, max(min_size, max_size)
+        with timed('fit'):
+            while low <= high:
+                size = (low + high) // 2
+                lines, fits = attempt(size)
+                if fits:
+                    best = (size, lines)
+                    low = size + 1
+                else:
+                    high = size - 1
+            
+            if best is None:
+                lines, _ = attempt(min_size)
+                return min_size, '\n'.join(lines), False
+        return best[0], '\n'.join(best[1]), True
+    
+    def draw_card_lines(self, draw, layout, fill, top=0, bottom=None):
+        """Draw laid-out lines, shifted up by top; lines outside [top, bottom) are skipped"""
+        for x, y, line, bbox in layout['placements']:
+            if bottom is not None and (y + bbox[1] >= bottom or y + bbox[3] <= top):
+                continue
+            
+            # Draw text with better rendering
+            try:
+                shaped = layout_cache.get(layout['font'], line)
+                if shaped:
+                    # Reuse the glyph mask shaped while measuring
+                    draw.bitmap((x + bbox[0], y - top + bbox[1]), shaped['mask'], fill=fill)
+                else:
+                    draw.text((x, y - top), line, font=layout['font'], fill=fill)
+            except Exception as e:
+                print(f"Error drawing text: {e}")
+                # Fallback: draw with basic font
+                basic_font = ImageFont.load_default()
+                draw.text((x, y - top), line, font=basic_font, fill=fill)
+    
+    def create_card_image(self, text, width, height, font_size, font_color, bg_color, 
+                         alignment, line_spacing, font_family, dpi=300, padding=None):
+        """Create high-quality card image with improved text rendering"""
+        try:
+            layout = self.layout_card(text, width, height, font_size, alignment,
+                                      line_spacing, font_family, dpi, padding)
+            
+            # Create image with high DPI
+            with timed('draw'):
+                img = Image.new('RGB', (layout['width'], layout['height']), self.hex_to_rgb(bg_color))
+                draw = ImageDraw.Draw(img)
+                self.draw_card_lines(draw, layout, self.hex_to_rgb(font_color))
             
             return img
             
@@ -188,97 +1274,160 @@ class UrduCardGenerator:
             error_draw.text((20, 20), f"Error: {str(e)}", fill=(255, 0, 0))
             return error_img
     
+    def iter_card_strips(self, text, width, height, font_size, font_color, bg_color,
+                         alignment, line_spacing, font_family, dpi=300, padding=None,
+                         strip_height=TILE_STRIP_HEIGHT):
+        """Yield (top, strip image) bands of a card; memory is bounded by one strip"""
+        layout = self.layout_card(text, width, height, font_size, alignment,
+                                  line_spacing, font_family, dpi, padding)
+        bg_rgb = self.hex_to_rgb(bg_color)
+        font_rgb = self.hex_to_rgb(font_color)
+        
+        for top in range(0, layout['height'], strip_height):
+            bottom = min(top + strip_height, layout['height'])
+            strip = Image.new('RGB', (layout['width'], bottom - top), bg_rgb)
+            self.draw_card_lines(ImageDraw.Draw(strip), layout, font_rgb, top, bottom)
+            yield top, strip
+    
+    def write_card_jpeg_tiled(self, out, dpi=300, quality=95, **params):
+        """Encode a card to JPEG strip by strip through a file-backed frame
+        
+        Strips are appended to a temporary file that is then memory-mapped
+        for the JPEG encoder, so the heap only ever holds one strip. The
+        encoder still touches the whole mapping, so the frame is resident
+        while encoding; it is reclaimable page cache only when TILE_DIR is
+        disk-backed (on tmpfs it is RAM) and admission charges it in full.
+        """
+        layout = self.layout_card(params['text'], params['width'], params['height'],
+                                  params['font_size'], params['alignment'],
+                                  params['line_spacing'], params['font_family'], dpi,
+                                  params.get('padding'))
+        row_bytes = layout['width'] * 4
+        
+        with tempfile.TemporaryFile(dir=TILE_DIR) as frame_file:
+            for top, strip in self.iter_card_strips(dpi=dpi, **params):
+                frame_file.write(strip.tobytes('raw', 'RGBX'))
+                del strip
+            frame_file.flush()
+            
+            with mmap.mmap(frame_file.fileno(), row_bytes * layout['height'],
+                           access=mmap.ACCESS_READ) as frame:
+                if hasattr(frame, 'madvise'):
+                    # Let the kernel drop pages the encoder has already read
+                    frame.madvise(mmap.MADV_SEQUENTIAL)
+                img = Image.frombuffer('RGBX', (layout['width'], layout['height']), frame,
+                                       'raw', 'RGBX', 0, 1)
+                # optimize/progressive make libjpeg buffer the whole image
+                img.save(out, 'JPEG', quality=quality, dpi=(dpi, dpi))
+                del img
+    
+    def register_pdf_font(self, font_family, weight=None):
+        """Register a catalog font with ReportLab, returning the font name to use"""
+        font_path = font_registry.resolve(font_family, weight) or font_registry.fallback_path
+        if font_path:
+            font_name = pdf_fonts.register(font_path)
+            if font_name:
+                return font_name
+        
+        return "Helvetica"
+    
+    def draw_pdf_card(self, c, page_width, page_height, text, font_size, font_color,
+                      bg_color, alignment, line_spacing, font_name, background=True,
+                      line_filter=None, padding=None):
+        """Draw one card into the current canvas coordinate system
+        
+        background=False skips the background fill and line_filter(index)
+        selects which lines to draw; line positions are unaffected by both.
+        padding is in mm; None keeps the default 20 pt inset.
+        """
+        padding = 20 if padding is None else padding * MM_TO_POINTS
+        
+        # Set background color
+        if background and bg_color != '#FFFFFF' and bg_color != '#ffffff':
+            bg_rgb = self.hex_to_rgb(bg_color)
+            c.setFillColor(Color(bg_rgb[0]/255, bg_rgb[1]/255, bg_rgb[2]/255))
+            c.rect(0, 0, page_width, page_height, fill=1, stroke=0)
+        
+        c.setFont(font_name, int(font_size))
+        
+        # Set text color
+        font_rgb = self.hex_to_rgb(font_color)
+        c.setFillColor(Color(font_rgb[0]/255, font_rgb[1]/255, font_rgb[2]/255))
+        
+        # Process text
+        if not text or not text.strip():
+            text = "نمونہ متن\nSample Text"
+        
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        if not lines:
+            lines = ["نمونہ متن"]
+        
+        # Draw text lines
+        for i, line in enumerate(lines):
+            if line_filter is not None and not line_filter(i):
+                continue
+            if line:
+                try:
+                    # Calculate text width for alignment
+                    text_width = c.stringWidth(line, font_name, int(font_size))
+                    x, y = self.pdf_line_origin(i, len(lines), text_width, page_width, page_height,
+                                                font_size, alignment, line_spacing, padding)
+                    c.drawString(x, y, line)
+                    
+                except Exception as e:
+                    print(f"Error drawing PDF text line: {e}")
+                    # Fallback positioning
+                    line_height = int(font_size) + int(line_spacing)
+                    start_y = page_height - (page_height - len(lines) * line_height) / 2
+                    c.drawString(padding, start_y - (i * line_height), line)
+    
+    def pdf_line_origin(self, index, count, text_width, page_width, page_height, font_size,
+                        alignment, line_spacing, padding):
+        """Baseline origin (x, y) in points of line index of count on a PDF card"""
+        # Calculate layout
+        line_height = int(font_size) + int(line_spacing)
+        total_height = count * line_height
+        start_y = page_height - (page_height - total_height) / 2
+        
+        # Calculate X position
+        if alignment == 'center':
+            x = max(padding, (page_width - text_width) / 2)
+        elif alignment == 'right':
+            x = max(padding, page_width - text_width - padding)
+        else:  # left
+            x = padding
+        
+        y = start_y - (index * line_height)
+        
+        # Ensure text is within bounds
+        x = max(padding, min(x, page_width - padding))
+        y = max(line_height, min(y, page_height - padding))
+        return x, y
+    
     def create_pdf(self, text, width, height, font_size, font_color, bg_color,
-                   alignment, line_spacing, font_family):
+                   alignment, line_spacing, font_family, padding=None):
         """Create PDF with improved Urdu text support"""
+        load_reportlab()
         try:
             buffer = io.BytesIO()
             
             # Convert mm to points (1 mm = 2.834645669 points)
-            page_width = float(width) * 2.834645669
-            page_height = float(height) * 2.834645669
+            page_width = float(width) * MM_TO_POINTS
+            page_height = float(height) * MM_TO_POINTS
             
             c = pdf_canvas.Canvas(buffer, pagesize=(page_width, page_height))
             
-            # Set background color
-            if bg_color != '#FFFFFF' and bg_color != '#ffffff':
-                bg_rgb = self.hex_to_rgb(bg_color)
-                c.setFillColor(Color(bg_rgb[0]/255, bg_rgb[1]/255, bg_rgb[2]/255))
-                c.rect(0, 0, page_width, page_height, fill=1)
-            
             # Try to register and use Urdu font
-            font_registered = False
-            try:
-                font_paths = [
-                    f"static/fonts/{font_family}.ttf",
-                    f"static/fonts/{font_family}.otf",
-                    f"static/fonts/{font_family.replace(' ', '')}.ttf",
-                ]
-                
-                for font_path in font_paths:
-                    if os.path.exists(font_path):
-                        pdfmetrics.registerFont(TTFont(font_family, font_path))
-                        c.setFont(font_family, int(font_size))
-                        font_registered = True
-                        break
-                
-                if not font_registered:
-                    c.setFont("Helvetica", int(font_size))
-                    
-            except Exception as e:
-                print(f"Font registration error: {e}")
-                c.setFont("Helvetica", int(font_size))
+            with timed('pdf_font'):
+                font_name = self.register_pdf_font(font_family)
             
-            # Set text color
-            font_rgb = self.hex_to_rgb(font_color)
-            c.setFillColor(Color(font_rgb[0]/255, font_rgb[1]/255, font_rgb[2]/255))
+            with timed('pdf_draw'):
+                self.draw_pdf_card(c, page_width, page_height, text, font_size, font_color,
+                                   bg_color, alignment, line_spacing, font_name,
+                                   padding=padding)
             
-            # Process text
-            if not text or not text.strip():
-                text = "نمونہ متن\nSample Text"
-            
-            lines = [line.strip() for line in text.split('\n') if line.strip()]
-            if not lines:
-                lines = ["نمونہ متن"]
-            
-            # Calculate layout
-            line_height = int(font_size) + int(line_spacing)
-            total_height = len(lines) * line_height
-            start_y = page_height - (page_height - total_height) / 2
-            
-            # Draw text lines
-            for i, line in enumerate(lines):
-                if line:
-                    try:
-                        # Calculate text width for alignment
-                        if font_registered:
-                            text_width = c.stringWidth(line, font_family, int(font_size))
-                        else:
-                            text_width = c.stringWidth(line, "Helvetica", int(font_size))
-                        
-                        # Calculate X position
-                        padding = 20
-                        if alignment == 'center':
-                            x = max(padding, (page_width - text_width) / 2)
-                        elif alignment == 'right':
-                            x = max(padding, page_width - text_width - padding)
-                        else:  # left
-                            x = padding
-                        
-                        y = start_y - (i * line_height)
-                        
-                        # Ensure text is within bounds
-                        x = max(padding, min(x, page_width - padding))
-                        y = max(line_height, min(y, page_height - 20))
-                        
-                        c.drawString(x, y, line)
-                        
-                    except Exception as e:
-                        print(f"Error drawing PDF text line: {e}")
-                        # Fallback positioning
-                        c.drawString(20, start_y - (i * line_height), line)
-            
-            c.save()
+            with timed('pdf_save'):
+                c.save()
             buffer.seek(0)
             return buffer
             
@@ -292,275 +1441,2230 @@ class UrduCardGenerator:
             c.save()
             buffer.seek(0)
             return buffer
+    
+    def create_imposed_pdf(self, cards, page_size='A4', landscape=False, margin=10,
+                           gutter=5, crop_marks=True):
+        """Lay out many cards per sheet (n-up) in a single multi-page PDF
+        
+        cards are dicts as returned by parse_card_params. Every card gets a
+        cell the size of the largest card; margin and gutter are in mm.
+        """
+        load_reportlab()
+        buffer = io.BytesIO()
+        page_width, page_height = PAGE_SIZES[page_size]
+        if landscape:
+            page_width, page_height = page_height, page_width
+        
+        cell_width = max(float(card['width']) for card in cards) * MM_TO_POINTS
+        cell_height = max(float(card['height']) for card in cards) * MM_TO_POINTS
+        margin_pt = margin * MM_TO_POINTS
+        gutter_pt = gutter * MM_TO_POINTS
+        
+        cols = int((page_width - 2 * margin_pt + gutter_pt) // (cell_width + gutter_pt))
+        rows = int((page_height - 2 * margin_pt + gutter_pt) // (cell_height + gutter_pt))
+        if cols < 1 or rows < 1:
+            raise ValueError(f'Card does not fit on a {page_size} page with {margin}mm margins')
+        
+        # Center the grid on the sheet
+        grid_width = cols * cell_width + (cols - 1) * gutter_pt
+        grid_height = rows * cell_height + (rows - 1) * gutter_pt
+        left = (page_width - grid_width) / 2
+        top = page_height - (page_height - grid_height) / 2
+        
+        c = pdf_canvas.Canvas(buffer, pagesize=(page_width, page_height))
+        
+        # Register each font once for the whole document
+        font_names = {}
+        per_page = cols * rows
+        for start in range(0, len(cards), per_page):
+            for slot, card in enumerate(cards[start:start + per_page]):
+                row, col = divmod(slot, cols)
+                card_width = float(card['width']) * MM_TO_POINTS
+                card_height = float(card['height']) * MM_TO_POINTS
+                x = left + col * (cell_width + gutter_pt) + (cell_width - card_width) / 2
+                y = top - row * (cell_height + gutter_pt) - cell_height + (cell_height - card_height) / 2
+                
+                if card['font_family'] not in font_names:
+                    font_names[card['font_family']] = self.register_pdf_font(card['font_family'])
+                
+                c.saveState()
+                c.translate(x, y)
+                clip = c.beginPath()
+                clip.rect(0, 0, card_width, card_height)
+                c.clipPath(clip, stroke=0, fill=0)
+                self.draw_pdf_card(c, card_width, card_height, card['text'], card['font_size'],
+                                   card['font_color'], card['bg_color'], card['alignment'],
+                                   card['line_spacing'], font_names[card['font_family']],
+                                   padding=card.get('padding'))
+                c.restoreState()
+            
+            if crop_marks:
+                self.draw_crop_marks(c, left, top, cols, rows, cell_width, cell_height, gutter_pt)
+            c.showPage()
+        
+        c.save()
+        buffer.seek(0)
+        return buffer
+    
+    def draw_crop_marks(self, c, left, top, cols, rows, cell_width, cell_height, gutter):
+        """Draw cut marks outside the card grid, aligned with every cell edge"""
+        mark_length = 4 * MM_TO_POINTS
+        offset = 1 * MM_TO_POINTS
+        bottom = top - rows * cell_height - (rows - 1) * gutter
+        right = left + cols * cell_width + (cols - 1) * gutter
+        
+        c.saveState()
+        c.setLineWidth(0.25)
+        c.setStrokeColor(Color(0, 0, 0))
+        for col in range(cols):
+            x0 = left + col * (cell_width + gutter)
+            for x in (x0, x0 + cell_width):
+                c.line(x, top + offset, x, top + offset + mark_length)
+                c.line(x, bottom - offset, x, bottom - offset - mark_length)
+        for row in range(rows):
+            y0 = top - row * (cell_height + gutter)
+            for y in (y0, y0 - cell_height):
+                c.line(left - offset, y, left - offset - mark_length, y)
+                c.line(right + offset, y, right + offset + mark_length, y)
+        c.restoreState()
+
+    @staticmethod
+    def css_weight(font_weight):
+        """Numeric weight for a CSS font-weight value"""
+        font_weight = str(font_weight).lower()
+        if font_weight.isdigit():
+            return int(font_weight)
+        return {'bold': 700, 'bolder': 700, 'lighter': 300}.get(font_weight, 400)
+    
+    def get_weighted_font(self, font_family, font_weight, font_size_px):
+        """Get the installed face of a family nearest to a CSS weight"""
+        return self.get_font(font_family, font_size_px, self.css_weight(font_weight))
+    
+    def scene_line_positions(self, element, measure):
+        """Yield (line, x, baseline_y, anchor) for a canvas-pro text element
+        
+        Mirrors renderTextElement in canvas-editor-pro.js; coordinates are
+        scene pixels relative to the element centre, y pointing down.
+        """
+        lines = element['text'].split('\n')
+        line_height = element['fontSize'] + element['lineSpacing']
+        start_y = element['fontSize']
+        if element['alignment'] == 'center':
+            start_y = (element['height'] - (len(lines) - 1) * line_height) / 2 + element['fontSize']
+        
+        if element['alignment'] == 'center':
+            text_x, anchor = element['width'] / 2, 'center'
+        elif element['alignment'] == 'right':
+            text_x, anchor = element['width'] - 10, 'right'
+        else:
+            text_x, anchor = 10, 'left'
+        
+        for index, line in enumerate(lines):
+            y = start_y + index * line_height - element['height'] / 2
+            x = text_x - element['width'] / 2
+            if element['wordSpacing'] and line.strip():
+                # Lay words out left to right with the extra spacing between them
+                words = line.split()
+                word_widths = [measure(word) for word in words]
+                total = sum(word_widths) + measure(' ') * (len(words) - 1) + element['wordSpacing'] * (len(words) - 1)
+                if anchor == 'center':
+                    x -= total / 2
+                elif anchor == 'right':
+                    x -= total
+                for word, word_width in zip(words, word_widths):
+                    yield word, x, y, 'left'
+                    x += word_width + measure(' ') + element['wordSpacing']
+            elif line:
+                yield line, x, y, anchor
+    
+    def scene_element_lines(self, element, scale):
+        """(font, placed lines) of a canvas-pro element rasterized at scale output px per scene px"""
+        font_size_px = max(1, int(round(element['fontSize'] * scale)))
+        font = self.get_weighted_font(element['fontFamily'], element['fontWeight'], font_size_px)
+        measure = lambda text: font.getlength(text) / scale
+        return font, list(self.scene_line_positions(element, measure))
+    
+    def scene_layer_extent(self, element, font, placed, scale, img_width, img_height):
+        """Half the side in pixels of the square layer an element is drawn on
+        
+        The layer is centred on the element and covers its text, plus the
+        shadow offset and blur. It is capped at the distance from the element
+        centre to the farthest page corner, because text beyond that lands off
+        the page at any rotation.
+        """
+        pil_anchors = {'left': 'ls', 'center': 'ms', 'right': 'rs'}
+        blur_px = element['shadowBlur'] * scale
+        margin = 2 * scale + 3 * blur_px if blur_px else 0
+        
+        extent = 1
+        for text, x, y, anchor in placed:
+            left, top, right, bottom = font.getbbox(text, anchor=pil_anchors[anchor])
+            extent = max(extent, abs(x * scale + left), abs(x * scale + right),
+                         abs(y * scale + top), abs(y * scale + bottom))
+        
+        center_x = (element['x'] + element['width'] / 2) * scale
+        center_y = (element['y'] + element['height'] / 2) * scale
+        reach = max(math.hypot(corner_x - center_x, corner_y - center_y)
+                    for corner_x in (0, img_width) for corner_y in (0, img_height))
+        return int(min(extent, reach) + margin) + 2
+    
+    def create_scene_image(self, scene, dpi):
+        """Rasterize a canvas-pro scene at any DPI"""
+        scale = dpi / scene['sceneDpi']
+        img_width = max(1, int(round(scene['width'] * dpi / 25.4)))
+        img_height = max(1, int(round(scene['height'] * dpi / 25.4)))
+        img = Image.new('RGB', (img_width, img_height), self.hex_to_rgb(scene['backgroundColor']))
+        pil_anchors = {'left': 'ls', 'center': 'ms', 'right': 'rs'}
+        
+        for element in scene['textElements']:
+            font, placed = self.scene_element_lines(element, scale)
+            if not placed:
+                continue
+            
+            shadow = element['shadowBlur'] > 0
+            blur_px = element['shadowBlur'] * scale if shadow else 0
+            
+            # Size a layer centred on the element so rotation keeps the centre fixed
+            extent = self.scene_layer_extent(element, font, placed, scale, img_width, img_height)
+            layer = Image.new('RGBA', (2 * extent, 2 * extent), (0, 0, 0, 0))
+            
+            if shadow:
+                shadow_mask = Image.new('L', layer.size, 0)
+                shadow_draw = ImageDraw.Draw(shadow_mask)
+                for text, x, y, anchor in placed:
+                    shadow_draw.text((extent + (x + 2) * scale, extent + (y + 2) * scale), text,
+                                     font=font, fill=255, anchor=pil_anchors[anchor])
+                shadow_mask = shadow_mask.filter(ImageFilter.GaussianBlur(blur_px / 2))
+                layer.paste(self.hex_to_rgb(element['shadowColor']) + (255,), mask=shadow_mask)
+            
+            draw = ImageDraw.Draw(layer)
+            fill = self.hex_to_rgb(element['color']) + (255,)
+            for text, x, y, anchor in placed:
+                draw.text((extent + x * scale, extent + y * scale), text, font=font,
+                          fill=fill, anchor=pil_anchors[anchor])
+            
+            if element['opacity'] < 100:
+                alpha = layer.getchannel('A').point(lambda a: a * element['opacity'] // 100)
+                layer.putalpha(alpha)
+            if element['rotation']:
+                # Canvas rotates clockwise for positive angles, PIL counter-clockwise
+                layer = layer.rotate(-element['rotation'], resample=Image.BICUBIC, expand=True)
+            
+            center_x = (element['x'] + element['width'] / 2) * scale
+            center_y = (element['y'] + element['height'] / 2) * scale
+            img.paste(layer, (int(round(center_x - layer.width / 2)), int(round(center_y - layer.height / 2))), layer)
+        
+        return img
+    
+    def create_scene_pdf(self, scene):
+        """Render a canvas-pro scene as a vector PDF
+        
+        With PDF_TEXT_SHAPING, lines are shaped by HarfBuzz and right-to-left
+        lines are reordered, so Urdu comes out joined and in reading order.
+        Without it only left-to-right text is drawn correctly, and
+        parse_scene_request refuses Urdu scenes.
+        """
+        load_reportlab()
+        buffer = io.BytesIO()
+        page_width = scene['width'] * MM_TO_POINTS
+        page_height = scene['height'] * MM_TO_POINTS
+        scale = 72 / scene['sceneDpi']  # scene pixels to points
+        c = pdf_canvas.Canvas(buffer, pagesize=(page_width, page_height))
+        
+        bg_rgb = self.hex_to_rgb(scene['backgroundColor'])
+        c.setFillColor(Color(bg_rgb[0]/255, bg_rgb[1]/255, bg_rgb[2]/255))
+        c.rect(0, 0, page_width, page_height, fill=1, stroke=0)
+        
+        for element in scene['textElements']:
+            font_name = self.register_pdf_font(element['fontFamily'],
+                                               self.css_weight(element['fontWeight']))
+            font_size = element['fontSize'] * scale
+            if PDF_TEXT_SHAPING:
+                measure = lambda text: bidiShapedText(text, scene_direction(text), fontName=font_name,
+                                                      fontSize=font_size, shaping=True)[1] / scale
+            else:
+                measure = lambda text: c.stringWidth(text, font_name, font_size) / scale
+            placed = list(self.scene_line_positions(element, measure))
+            
+            c.saveState()
+            center_x = (element['x'] + element['width'] / 2) * scale
+            center_y = page_height - (element['y'] + element['height'] / 2) * scale
+            c.translate(center_x, center_y)
+            # PDF y points up, so a clockwise canvas rotation is negative here
+            c.rotate(-element['rotation'])
+            c.setFont(font_name, font_size)
+            
+            passes = []
+            if element['shadowBlur'] > 0:
+                # Shadows are drawn as solid offset text; PDF has no blur
+                passes.append((element['shadowColor'], 2, 0.5))
+            passes.append((element['color'], 0, 1.0))
+            for color, offset, alpha in passes:
+                rgb = self.hex_to_rgb(color)
+                c.setFillColor(Color(rgb[0]/255, rgb[1]/255, rgb[2]/255))
+                c.setFillAlpha(alpha * element['opacity'] / 100)
+                for text, x, y, anchor in placed:
+                    px, py = (x + offset) * scale, -(y + offset) * scale
+                    shaping = {'direction': scene_direction(text), 'shaping': True} if PDF_TEXT_SHAPING else {}
+                    if anchor == 'center':
+                        c.drawCentredString(px, py, text, **shaping)
+                    elif anchor == 'right':
+                        c.drawRightString(px, py, text, **shaping)
+                    else:
+                        c.drawString(px, py, text, **shaping)
+            c.restoreState()
+        
+        c.save()
+        buffer.seek(0)
+        return buffer
 
 card_generator = UrduCardGenerator()
 
+def parse_card_params(data, fit=True):
+    """Validate and normalize card parameters from a request payload
+    
+    With autoFit, fontSize is ignored: the text is wrapped and sized to the
+    largest font that fits inside the padding (in mm) on the server.
+    fit=False leaves that to the caller (see fit_card_params).
+    """
+    text = data.get('text', 'نمونہ متن\nSample Text')
+    width = max(10, min(500, float(data.get('width', 100))))
+    height = max(10, min(500, float(data.get('height', 70))))
+    font_size = max(8, min(72, int(data.get('fontSize', 16))))
+    font_color = data.get('fontColor', '#000000')
+    bg_color = data.get('backgroundColor', '#FFFFFF')
+    alignment = data.get('alignment', 'right')
+    line_spacing = max(0, min(50, int(data.get('lineSpacing', 5))))
+    font_family = data.get('fontFamily', 'Noto Nastaliq Urdu')
+    padding = data.get('padding')
+    if padding is not None:
+        padding = max(0.0, min(min(width, height) / 4, float(padding)))
+    
+    # Validate color formats
+    if not isinstance(font_color, str) or not font_color.startswith('#') or len(font_color) != 7:
+        font_color = '#000000'
+    if not isinstance(bg_color, str) or not bg_color.startswith('#') or len(bg_color) != 7:
+        bg_color = '#FFFFFF'
+    
+    if auto_fit_requested(data) and padding is None:
+        padding = min(AUTO_FIT_PADDING, min(width, height) / 4)
+    
+    params = {
+        'text': str(text).replace('\r\n', '\n'),
+        'width': width,
+        'height': height,
+        'font_size': font_size,
+        'font_color': font_color.upper(),
+        'bg_color': bg_color.upper(),
+        'alignment': alignment,
+        'line_spacing': line_spacing,
+        'font_family': font_family,
+        'padding': padding,
+    }
+    if fit and auto_fit_requested(data):
+        params = fit_card_params(params)
+    return params
+
+def fit_card_params(params):
+    """Card parameters with the text wrapped and sized by UrduCardGenerator.fit_text"""
+    font_size, text, fits = card_generator.fit_text(
+        params['text'], params['width'], params['height'], params['alignment'],
+        params['line_spacing'], params['font_family'], params['padding'])
+    if not fits:
+        print(f"Auto-fit: text overflows a {params['width']}x{params['height']}mm card even at {font_size} pt")
+    return dict(params, text=text, font_size=font_size)
+
+def auto_fit_requested(data):
+    """Whether a card request asks for server-side auto-fit"""
+    return data.get('autoFit') in (True, 1, '1', 'true', 'yes')
+
+def fit_headers(data, params):
+    """Response headers reporting the auto-fit result of a card request"""
+    if not auto_fit_requested(data):
+        return {}
+    return {'X-Fit-Font-Size': str(params['font_size']),
+            'X-Fit-Lines': str(len([line for line in params['text'].split('\n') if line.strip()]))}
+
+def parse_color(value, default):
+    """Return value if it is a #RRGGBB color, otherwise default"""
+    if isinstance(value, str) and value.startswith('#') and len(value) == 7:
+        try:
+            int(value[1:], 16)
+            return value.upper()
+        except ValueError:
+            pass
+    return default
+
+def parse_scene(data):
+    """Validate a canvas-pro scene description (textElements plus background)"""
+    elements = data.get('textElements')
+    if not isinstance(elements, list):
+        raise ValueError('textElements must be a list')
+    if len(elements) > SCENE_MAX_ELEMENTS:
+        raise ValueError(f'Too many text elements (maximum {SCENE_MAX_ELEMENTS})')
+    
+    width = max(10, min(500, float(data.get('width', 100))))
+    height = max(10, min(500, float(data.get('height', 70))))
+    scene_dpi = max(72, min(2400, float(data.get('sceneDpi', 600))))
+    
+    # Element geometry is kept within reach of the page, in scene pixels
+    page_width = width * scene_dpi / 25.4
+    page_height = height * scene_dpi / 25.4
+    
+    text_elements = []
+    for element in elements:
+        if len(str(element.get('text', ''))) > SCENE_MAX_TEXT_LENGTH:
+            raise ValueError(f'Text element too long (maximum {SCENE_MAX_TEXT_LENGTH} characters)')
+        alignment = element.get('alignment', 'right')
+        text_elements.append({
+            'text': str(element.get('text', '')).replace('\r\n', '\n'),
+            'x': max(-page_width, min(page_width, float(element.get('x', 0)))),
+            'y': max(-page_height, min(page_height, float(element.get('y', 0)))),
+            'width': max(1, min(2 * page_width, float(element.get('width', 250)))),
+            'height': max(1, min(2 * page_height, float(element.get('height', 80)))),
+            'fontSize': max(1, min(2000, max(page_width, page_height),
+                                   float(element.get('fontSize', 24)))),
+            'fontFamily': str(element.get('fontFamily', 'Noto Nastaliq Urdu')),
+            'fontWeight': str(element.get('fontWeight', '400')),
+            'color': parse_color(element.get('color'), '#000000'),
+            'alignment': alignment if alignment in ('left', 'center', 'right') else 'right',
+            'rotation': float(element.get('rotation', 0)) % 360,
+            'lineSpacing': max(0, min(page_height, float(element.get('lineSpacing', 8)))),
+            'wordSpacing': max(0, min(page_width, float(element.get('wordSpacing', 0)))),
+            'shadowColor': parse_color(element.get('shadowColor'), '#000000'),
+            'shadowBlur': max(0, min(200, float(element.get('shadowBlur', 0)))),
+            'opacity': max(0, min(100, float(element.get('opacity', 100)))),
+        })
+    
+    return {
+        'width': width,
+        'height': height,
+        'backgroundColor': parse_color(data.get('backgroundColor'), '#FFFFFF'),
+        # Units of element coordinates; the pro editor canvas is 600 dpi
+        'sceneDpi': scene_dpi,
+        'textElements': text_elements,
+    }
+
+def card_pixels(params, dpi):
+    """Pixel count of a card rendered at dpi"""
+    return max(int(params['width'] * dpi / 25.4), 200) * max(int(params['height'] * dpi / 25.4), 100)
+
+def estimate_card_bytes(params, fmt, dpi):
+    """Estimated peak memory of rendering a card (PIL keeps RGB at 4 bytes/pixel)"""
+    if fmt == 'pdf':
+        return 4 * 1024 * 1024
+    pixels = card_pixels(params, dpi)
+    if fmt == 'jpg' and pixels > TILED_RENDER_PIXELS:
+        # The mapped frame becomes resident while encoding (and is plain RAM
+        # when TILE_DIR is on tmpfs), plus one strip and its RGBX copy
+        width_px = max(int(params['width'] * dpi / 25.4), 200)
+        return pixels * 4 + width_px * TILE_STRIP_HEIGHT * 4 * 2
+    if fmt == 'jpg':
+        # The frame, its RGBX copy for the encoder and the DCT coefficients
+        # that optimize=True buffers for the whole image
+        return pixels * 8
+    return pixels * 4
+
+def encode_preview(img, fmt, effort=PREVIEW_EFFORT):
+    """Encode a throwaway preview image as fast as possible
+    
+    Formats are 'webp', 'png' and 'palette' (PNG quantized to 256 colors,
+    which is lossless in practice for two-color text cards).
+    """
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        img.save(buffer, 'WEBP', quality=PREVIEW_WEBP_QUALITY, method=max(0, min(6, effort)))
+    else:
+        if fmt == 'palette':
+            img = img.quantize(256, method=Image.Quantize.FASTOCTREE)
+        img.save(buffer, 'PNG', compress_level=max(0, min(9, effort)))
+    return buffer.getvalue()
+
+def render_card_bytes(params, fmt, dpi, tiled=None, effort=PREVIEW_EFFORT):
+    """Render and encode a card as preview (see PREVIEW_FORMATS), JPEG or PDF bytes
+    
+    Large JPEG cards (TILED_RENDER_PIXELS) are rendered in strips unless
+    tiled is given explicitly.
+    """
+    if fmt == 'pdf':
+        return card_generator.create_pdf(**params).getvalue()
+    
+    if tiled is None:
+        tiled = card_pixels(params, dpi) > TILED_RENDER_PIXELS
+    if fmt == 'jpg' and tiled:
+        buffer = io.BytesIO()
+        with timed('render_tiled'):
+            card_generator.write_card_jpeg_tiled(buffer, dpi=dpi, **params)
+        return buffer.getvalue()
+    
+    img = card_generator.create_card_image(dpi=dpi, **params)
+    buffer = io.BytesIO()
+    with timed(f'encode_{fmt}'):
+        if fmt in PREVIEW_FORMATS:
+            return encode_preview(img, fmt, effort)
+        else:
+            # Convert to RGB if necessary and save with high quality
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(buffer, 'JPEG', quality=95, dpi=(dpi, dpi), optimize=True)
+    return buffer.getvalue()
+
+def send_export(data, filename, mimetype):
+    """Send export bytes from memory, archiving a copy to disk if enabled"""
+    try:
+        export_archive.save(data, filename)
+    except OSError as e:
+        # Archival is best effort and must not fail the download
+        print(f"Export archive error: {e}")
+    return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True, download_name=filename)
+
+def cached_card_bytes(params, fmt, dpi, effort=PREVIEW_EFFORT, route=None, admit_timeout=None):
+    """Return (cache_key, bytes) for a card, rendering only on a cache miss
+    
+    Identical concurrent misses share a single render. With route given,
+    that render is admitted against the memory budget under the route name.
+    """
+    key_params = dict(params, dpi=dpi)
+    if fmt in PREVIEW_FORMATS:
+        key_params['effort'] = effort
+    key = RenderCache.make_key(fmt, key_params)
+    
+    def render():
+        if route is None:
+            return render_card_bytes(params, fmt, dpi, effort=effort)
+        with admission.admit(route, estimate_card_bytes(params, fmt, dpi), timeout=admit_timeout):
+            return render_card_bytes(params, fmt, dpi, effort=effort)
+    
+    return key, render_cache.get_or_render(key, render, flight=card_generator.single_flight)
+
+def preview_dpi(params, data):
+    """DPI for a preview tier: 'full' is PREVIEW_DPI, 'draft' fits the client viewport
+    
+    The viewport is given in device pixels (viewportWidth/viewportHeight);
+    drafts never exceed PREVIEW_DRAFT_MAX_DPI so they stay within a tight
+    latency budget.
+    """
+    tier = str(data.get('tier', 'full')).lower()
+    if tier != 'draft':
+        return 'full', PREVIEW_DPI
+    
+    dpi = PREVIEW_DRAFT_MAX_DPI
+    try:
+        viewport_width = float(data.get('viewportWidth') or 0)
+        viewport_height = float(data.get('viewportHeight') or 0)
+    except (TypeError, ValueError):
+        viewport_width = viewport_height = 0
+    if viewport_width > 0:
+        dpi = min(dpi, viewport_width * 25.4 / params['width'])
+    if viewport_height > 0:
+        dpi = min(dpi, viewport_height * 25.4 / params['height'])
+    return 'draft', max(PREVIEW_DRAFT_MIN_DPI, int(dpi))
+
+def negotiate_preview(data):
+    """Pick the preview format: an explicit previewFormat, else the Accept header
+    
+    Returns None for the legacy JSON response with a base64 data URL, which
+    stays the default for clients that do not ask for an image type.
+    """
+    fmt = str(request.args.get('format') or data.get('previewFormat') or '').lower()
+    if fmt in PREVIEW_FORMATS or fmt == 'json':
+        return None if fmt == 'json' else fmt
+    best = request.accept_mimetypes.best_match(['application/json', 'image/webp', 'image/png'])
+    if best == 'image/webp':
+        return 'webp'
+    if best == 'image/png':
+        return 'palette'
+    return None
+
+def preview_effort(data, kind):
+    """Client previewEffort clamped to the encoder's range (WebP method 0-6, PNG level 0-9)
+    
+    Clamping before the value reaches the cache key keeps out-of-range
+    efforts from each filling their own cache entry.
+    """
+    try:
+        effort = int(float(data.get('previewEffort', PREVIEW_EFFORT)))
+    except (TypeError, ValueError, OverflowError):
+        effort = PREVIEW_EFFORT
+    return max(0, min(6 if kind == 'webp' else 9, effort))
+
+def preview_etag(fmt, params, dpi, effort):
+    """ETag for a preview response; JSON and binary bodies of the same image differ"""
+    representation = 'binary' if fmt else 'json'
+    return RenderCache.make_key(fmt or 'png', dict(params, dpi=dpi, effort=effort,
+                                                   representation=representation))
+
+WARM_UP_SECONDS = None
+# Idle time from worker start until its first request arrived, and that request's handling time
+FIRST_REQUEST_WAIT_SECONDS = None
+FIRST_REQUEST_SECONDS = None
+
+def warm_up():
+    """Load fonts, ReportLab and the render path once, before gunicorn forks
+    
+    With --preload this runs in the master (see gunicorn.conf.py), so every
+    worker starts with parsed fonts and imported modules shared
+    copy-on-write instead of paying for them on its first request.
+    """
+    global WARM_UP_SECONDS
+    started = time.perf_counter()
+    
+    load_reportlab()
+    for font_path in font_registry.font_paths():
+        pdf_fonts.register(font_path)
+    webfonts.build_core()
+    
+    # Shape, draw and encode a default preview to load FreeType and the encoders
+    params = parse_card_params({})
+    img = card_generator.create_card_image(dpi=PREVIEW_DPI, **params)
+    for fmt in PREVIEW_FORMATS:
+        encode_preview(img, fmt)
+    
+    WARM_UP_SECONDS = time.perf_counter() - started
+    print(f"Warm-up done in {WARM_UP_SECONDS:.2f}s ({len(font_registry.font_paths())} fonts)")
+
+def mark_worker_started():
+    """Restart the first-request clocks in a freshly forked worker"""
+    global STARTED_AT, FIRST_REQUEST_WAIT_SECONDS, FIRST_REQUEST_SECONDS
+    STARTED_AT = time.time()
+    FIRST_REQUEST_WAIT_SECONDS = None
+    FIRST_REQUEST_SECONDS = None
+
+@app.before_request
+def start_request_timer():
+    global FIRST_REQUEST_WAIT_SECONDS
+    g.request_start = time.perf_counter()
+    _request_timings.stages = {}
+    if FIRST_REQUEST_WAIT_SECONDS is None:
+        FIRST_REQUEST_WAIT_SECONDS = time.time() - STARTED_AT
+
+def record_request_latency(endpoint, start):
+    """Observe a request's latency once its body has been sent (streamed bodies included)
+    
+    The worker's first request also records its handling time, which is
+    where a worker that was not warmed up pays for loading fonts.
+    """
+    global FIRST_REQUEST_SECONDS
+    elapsed = time.perf_counter() - start
+    metrics.observe('urdu_card_request_seconds', 'Request handling time by endpoint.',
+                    elapsed, {'endpoint': endpoint})
+    if FIRST_REQUEST_SECONDS is None:
+        FIRST_REQUEST_SECONDS = elapsed
+        print(f"Worker {os.getpid()} served its first request ({endpoint}) in {elapsed * 1000:.0f} ms "
+              f"after {FIRST_REQUEST_WAIT_SECONDS or 0:.2f}s idle, warmed up: {WARM_UP_SECONDS is not None}")
+
+@app.after_request
+def record_request_metrics(response):
+    stages = getattr(_request_timings, 'stages', None) or {}
+    _request_timings.stages = None
+    
+    if stages:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in stages.items())
+    
+    endpoint = request.endpoint or 'unknown'
+    labels = {'endpoint': endpoint, 'status': str(response.status_code)}
+    metrics.inc('urdu_card_requests_total', 'HTTP requests by endpoint and status.', labels)
+    if response.status_code >= 400:
+        metrics.inc('urdu_card_request_errors_total', 'HTTP requests that returned an error status.', labels)
+    
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        response.call_on_close(lambda: record_request_latency(endpoint, start))
+    
+    # Streamed responses (batch ZIPs) have no length up front
+    if response.content_length is not None:
+        metrics.observe('urdu_card_response_bytes', 'Response body size by endpoint.',
+                        response.content_length, {'endpoint': endpoint},
+                        buckets=Metrics.BYTES_BUCKETS)
+    return response
+
+def status_gauges():
+    """Current cache and job queue statistics as Prometheus gauges"""
+    gauges = {}
+    caches = [('render', render_cache.stats()), ('font', font_registry.stats()),
+              ('pdf_font', pdf_fonts.stats()), ('layout', layout_cache.stats())]
+    if render_cache.disk is not None:
+        caches.append(('render_disk', render_cache.disk.stats()))
+    for cache, stats in caches:
+        for stat, value in stats.items():
+            name = f'urdu_card_cache_{stat}'
+            gauges.setdefault(name, (f'Cache statistic "{stat}" by cache.', []))[1].append(({'cache': cache}, value))
+    for stat, value in job_queue.stats().items():
+        gauges[f'urdu_card_jobs_{stat}'] = (f'Export job queue statistic "{stat}".', [({}, value)])
+    for stat, value in admission.stats().items():
+        gauges[f'urdu_card_admission_{stat}'] = (f'Render admission statistic "{stat}".', [({}, value)])
+    if FIRST_REQUEST_WAIT_SECONDS is not None:
+        gauges['urdu_card_first_request_wait_seconds'] = (
+            'Idle seconds from worker start until its first request arrived.', [({}, FIRST_REQUEST_WAIT_SECONDS)])
+    if FIRST_REQUEST_SECONDS is not None:
+        gauges['urdu_card_first_request_seconds'] = (
+            "Handling time of the worker's first request, including any warm-up it paid for.",
+            [({}, FIRST_REQUEST_SECONDS)])
+    gauges['urdu_card_warm_up_seconds'] = (
+        'Seconds spent warming up before fork (0 when not preloaded).', [({}, WARM_UP_SECONDS or 0)])
+    return gauges
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for requests, render stages, output sizes and caches"""
+    return Response(metrics.render(status_gauges()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/canvas')
-def canvas():
-    return render_template('canvas.html')
+@app.route('/canvas')
+def canvas():
+    return render_template('canvas.html')
+
+@app.route('/canvas-pro')
+def canvas_pro():
+    # The vector PDF export is only offered when Urdu can be shaped
+    return render_template('canvas-pro.html', vector_pdf=PDF_TEXT_SHAPING)
+
+@app.route('/preview', methods=['POST'])
+def preview_card():
+    """Generate preview image with improved error handling
+    
+    Clients that accept image/webp or image/png (or pass previewFormat) get
+    the encoded bytes directly; others get JSON with a base64 data URL.
+    """
+    try:
+        data = request.json
+        params = parse_card_params(data)
+        fmt = negotiate_preview(data)
+        kind = fmt or 'png'
+        effort = preview_effort(data, kind)
+        
+        tier, tier_dpi = preview_dpi(params, data)
+        
+        # Unchanged previews are answered without rendering at all
+        etag = preview_etag(fmt, params, tier_dpi, effort)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.headers.update(fit_headers(data, params))
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            return response
+        
+        print(f"Preview request - Text: {params['text'][:50]}..., Size: {params['width']}x{params['height']}, Font: {params['font_family']}, Tier: {tier}")
+        
+        # Lower the DPI further if memory is short
+        dpi = admission.fit_dpi('preview', estimate_card_bytes(params, kind, tier_dpi), tier_dpi)
+        
+        # Queued bulk exports wait for previews
+        with job_queue.foreground():
+            _, image_bytes = cached_card_bytes(params, kind, dpi=dpi, effort=effort, route='preview')
+        etag = preview_etag(fmt, params, dpi, effort)
+        
+        if fmt:
+            response = Response(image_bytes, mimetype=PREVIEW_FORMATS[fmt])
+        else:
+            # Convert to base64 for preview
+            with timed('base64'):
+                img_str = base64.b64encode(image_bytes).decode()
+            
+            result = {
+                'success': True,
+                'image': f'data:image/png;base64,{img_str}',
+                'message': 'Preview generated successfully'
+            }
+            if auto_fit_requested(data):
+                result['fontSize'] = params['font_size']
+                result['text'] = params['text']
+            response = jsonify(result)
+        response.headers.update(fit_headers(data, params))
+        response.headers['X-Preview-Tier'] = tier
+        response.headers['X-Preview-Dpi'] = str(dpi)
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        return response
+    
+    except AdmissionRejected as e:
+        return admission_response(e)
+    except Exception as e:
+        print(f"Preview error: {e}")
+        import traceback
+        traceback.print_exc()
+        
+        return jsonify({
+            'success': False, 
+            'error': f'Preview generation failed: {str(e)}',
+            'message': 'Please check your input and try again'
+        }), 400
+
+@app.route('/export/jpg', methods=['POST'])
+def export_jpg():
+    """Export as high-quality JPG with improved error handling"""
+    try:
+        params = parse_card_params(request.json)
+        
+        print(f"JPG Export - Size: {params['width']}x{params['height']}, Font: {params['font_family']}")
+        
+        # High DPI for export
+        _, jpg_bytes = cached_card_bytes(params, 'jpg', dpi=300, route='export_jpg')
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        response = send_export(jpg_bytes, f"urdu_card_{timestamp}.jpg", 'image/jpeg')
+        response.headers.update(fit_headers(request.json, params))
+        return response
+    
+    except AdmissionRejected as e:
+        return admission_response(e)
+    except Exception as e:
+        print(f"JPG Export error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False, 
+            'error': f'JPG export failed: {str(e)}'
+        }), 500
+
+@app.route('/export/pdf', methods=['POST'])
+def export_pdf():
+    """Export as PDF with improved error handling"""
+    try:
+        params = parse_card_params(request.json)
+        
+        print(f"PDF Export - Size: {params['width']}x{params['height']}, Font: {params['font_family']}")
+        
+        _, pdf_bytes = cached_card_bytes(params, 'pdf', dpi=None, route='export_pdf')
+        
+        font_bytes = embedded_font_bytes(pdf_bytes)
+        print(f"PDF Export - {len(pdf_bytes)} bytes, embedded fonts: {font_bytes} bytes")
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        response = send_export(pdf_bytes, f"urdu_card_{timestamp}.pdf", 'application/pdf')
+        response.headers['X-Embedded-Font-Bytes'] = str(font_bytes)
+        response.headers.update(fit_headers(request.json, params))
+        return response
+    
+    except AdmissionRejected as e:
+        return admission_response(e)
+    except Exception as e:
+        print(f"PDF Export error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False, 
+            'error': f'PDF export failed: {str(e)}'
+        }), 500
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def get_batch_pool(reset=None):
+    """Return the shared process pool used for batch rendering
+    
+    Workers come from a forkserver (or spawn) context, never a fork of this
+    threaded process; the forkserver imports this module once so workers
+    start with fonts loaded. Passing a broken or hung pool as reset kills
+    its workers and replaces it, unless another batch already did.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if reset is not None and reset is _batch_pool:
+            # A hung render never returns, so its worker has to be killed
+            for process in list((reset._processes or {}).values()):
+                process.terminate()
+            reset.shutdown(wait=False, cancel_futures=True)
+            _batch_pool = None
+        if _batch_pool is None:
+            context = multiprocessing.get_context(BATCH_START_METHOD)
+            if BATCH_START_METHOD == 'forkserver' and __name__ != '__main__':
+                context.set_forkserver_preload([__name__])
+            _batch_pool = ProcessPoolExecutor(max_workers=max(1, BATCH_WORKERS), mp_context=context)
+        return _batch_pool
+
+def render_batch_card(params, fmt):
+    """Process pool entry point for rendering a single batch card"""
+    return render_card_bytes(params, fmt, dpi=300)
+
+class ZipStream:
+    """Write-only file object that collects zip output for streaming"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def zip_entry_name(index, spec, fmt):
+    """Archive name for the card at index; a spec 'filename' is sanitized and kept unique by the index"""
+    stem = ''
+    if isinstance(spec, dict) and spec.get('filename'):
+        stem = secure_filename(os.path.splitext(str(spec['filename']))[0])
+    return f"{index + 1:04d}_{stem}.{fmt}" if stem else f"urdu_card_{index + 1:04d}.{fmt}"
+
+def write_zip_entry(archive, filename, data, compression=zipfile.ZIP_STORED):
+    """Add one file to a streamed archive, stamped with the current time"""
+    archive.writestr(zipfile.ZipInfo(filename, date_time=datetime.now().timetuple()[:6]),
+                     data, compress_type=compression)
+
+def write_zip_summary(archive, succeeded, failures):
+    """Add summary.json with the counts and the failures in input order"""
+    summary = {
+        'total': succeeded + len(failures),
+        'succeeded': succeeded,
+        'failed': len(failures),
+        'failures': sorted(failures, key=lambda f: f['index']),
+    }
+    archive.writestr('summary.json', json.dumps(summary, ensure_ascii=False, indent=2))
+
+def time_limit_error(items):
+    """Failure message for work skipped at the synchronous export deadline"""
+    return (f'Not rendered: the export reached its {SYNC_EXPORT_SECONDS:g}s time limit; '
+            f'send fewer {items} per request')
 
-@app.route('/canvas-pro')
-def canvas_pro():
-    return render_template('canvas-pro.html')
+def read_batch_specs(key='cards'):
+    """Read card specs (or merge rows) from a JSON body or an uploaded CSV/JSONL file
+    
+    Options come from the query string, overridden by the form fields or
+    the JSON object, whichever the body is.
+    """
+    options = request.args.to_dict()
+    upload = request.files.get('file')
+    if upload is not None:
+        options.update(request.form.to_dict())
+        name = (upload.filename or '').lower()
+        content = upload.stream.read().decode('utf-8-sig')
+        if name.endswith('.csv'):
+            return list(csv.DictReader(io.StringIO(content))), options
+        if name.endswith('.jsonl') or name.endswith('.ndjson'):
+            return [json.loads(line) for line in content.splitlines() if line.strip()], options
+        raise ValueError('Upload must be a .csv or .jsonl file')
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        return data, options
+    if isinstance(data, dict) and isinstance(data.get(key), list):
+        options.update(data)
+        return data[key], options
+    raise ValueError(f'Expected a JSON array or {{"{key}": [...]}}')
 
-@app.route('/preview', methods=['POST'])
-def preview_card():
-    """Generate preview image with improved error handling"""
+def stream_batch_zip(jobs, fmt, concurrency, deadline):
+    """Render jobs on the process pool and yield a ZIP as cards complete
+    
+    Every card in flight holds its estimated memory in the admission
+    budget, and a card that renders for longer than BATCH_CARD_TIMEOUT
+    is recorded as failed. Cards not done by the deadline are reported
+    in summary.json instead of rendered, so the worker is never killed
+    mid-archive.
+    """
+    over_time = time_limit_error('cards')
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w')
+    compression = zipfile.ZIP_DEFLATED if fmt == 'pdf' else zipfile.ZIP_STORED
+    failures = []
+    succeeded = 0
+    pending = []
+    deferred = []
+    jobs = iter(jobs)
+    
+    def submit_next():
+        """Submit the next card; False when none is left or it must wait for budget"""
+        while True:
+            job = deferred.pop() if deferred else next(jobs, None)
+            if job is None:
+                return False
+            index, filename, params, error = job
+            hold = ExitStack()
+            if error is None:
+                try:
+                    # Only queue for budget when none of our own cards can free it
+                    hold.enter_context(admission.admit('batch', estimate_card_bytes(params, fmt, 300),
+                                                       timeout=0 if pending else None))
+                except AdmissionRejected as e:
+                    if pending and e.status == 503:
+                        deferred.append(job)
+                        return False
+                    error = str(e)
+            if error is not None:
+                failures.append({'index': index, 'filename': filename, 'error': error})
+                continue
+            try:
+                pool = get_batch_pool()
+                pending.append((index, filename, params, pool, pool.submit(render_batch_card, params, fmt), hold, 0))
+            except BaseException:
+                hold.close()
+                raise
+            return True
+    
     try:
-        data = request.json
+        # Keep at most `concurrency` cards of this batch in flight
+        while len(pending) < concurrency and submit_next():
+            pass
         
-        # Validate and sanitize input data
-        text = data.get('text', 'نمونہ متن\nSample Text')
-        width = max(10, min(500, float(data.get('width', 100))))
-        height = max(10, min(500, float(data.get('height', 70))))
-        font_size = max(8, min(72, int(data.get('fontSize', 16))))
-        font_color = data.get('fontColor', '#000000')
-        bg_color = data.get('backgroundColor', '#FFFFFF')
-        alignment = data.get('alignment', 'right')
-        line_spacing = max(0, min(50, int(data.get('lineSpacing', 5))))
-        font_family = data.get('fontFamily', 'Noto Nastaliq Urdu')
-        
-        # Validate color formats
-        if not font_color.startswith('#') or len(font_color) != 7:
-            font_color = '#000000'
-        if not bg_color.startswith('#') or len(bg_color) != 7:
-            bg_color = '#FFFFFF'
-        
-        print(f"Preview request - Text: {text[:50]}..., Size: {width}x{height}, Font: {font_family}")
-        
-        img = card_generator.create_card_image(
-            text=text,
-            width=width,
-            height=height,
-            font_size=font_size,
-            font_color=font_color,
-            bg_color=bg_color,
-            alignment=alignment,
-            line_spacing=line_spacing,
-            font_family=font_family,
-            dpi=150  # Lower DPI for faster preview
-        )
+        while pending:
+            index, filename, params, pool, future, hold, retries = pending.pop(0)
+            wait = min(BATCH_CARD_TIMEOUT, deadline - time.time())
+            try:
+                try:
+                    write_zip_entry(archive, filename, future.result(timeout=max(0, wait)), compression)
+                    succeeded += 1
+                except FutureTimeout:
+                    if wait < BATCH_CARD_TIMEOUT:
+                        # The export ran out of time; the card itself is not hung
+                        failures.append({'index': index, 'filename': filename, 'error': over_time})
+                    else:
+                        get_batch_pool(reset=pool)
+                        failures.append({'index': index, 'filename': filename,
+                                         'error': f'Timed out after {BATCH_CARD_TIMEOUT:g}s'})
+                except BrokenProcessPool as e:
+                    pool = get_batch_pool(reset=pool)
+                    if retries:
+                        failures.append({'index': index, 'filename': filename, 'error': f'Worker crashed: {e}'})
+                    else:
+                        # Usually another card's crash or timeout took the pool down; try once more
+                        pending.insert(0, (index, filename, params, pool,
+                                           pool.submit(render_batch_card, params, fmt), hold, retries + 1))
+                        hold = None
+                except Exception as e:
+                    failures.append({'index': index, 'filename': filename, 'error': str(e)})
+            finally:
+                if hold is not None:
+                    hold.close()
+            
+            if time.time() >= deadline:
+                break
+            while len(pending) < concurrency and submit_next():
+                pass
+            data = stream.drain()
+            if data:
+                yield data
         
-        # Convert to base64 for preview
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG', optimize=True)
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.getvalue()).decode()
+        # Past the deadline: report the rest and finish the archive
+        for index, filename, *_ in pending:
+            failures.append({'index': index, 'filename': filename, 'error': over_time})
+        for index, filename, params, error in itertools.chain(deferred, jobs):
+            failures.append({'index': index, 'filename': filename, 'error': error or over_time})
         
-        return jsonify({
-            'success': True,
-            'image': f'data:image/png;base64,{img_str}',
-            'message': 'Preview generated successfully'
-        })
+        write_zip_summary(archive, succeeded, failures)
+        archive.close()
+        yield stream.drain()
+    finally:
+        # Client went away or rendering stopped early
+        for _, _, _, _, future, hold, _ in pending:
+            future.cancel()
+            hold.close()
+
+@app.route('/export/batch', methods=['POST'])
+def export_batch():
+    """Render many cards in parallel and stream them back as a ZIP"""
+    try:
+        specs, options = read_batch_specs()
+        fmt = str(options.get('format', 'jpg')).lower()
+        if fmt not in ('jpg', 'pdf'):
+            return jsonify({'success': False, 'error': 'Format must be jpg or pdf'}), 400
+        if not specs:
+            return jsonify({'success': False, 'error': 'No cards provided'}), 400
+        if len(specs) > BATCH_MAX_CARDS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many cards: {len(specs)} (maximum {BATCH_MAX_CARDS})'
+            }), 413
+        
+        concurrency = max(1, min(BATCH_MAX_CONCURRENCY, int(options.get('concurrency', BATCH_MAX_CONCURRENCY))))
+        
+        def jobs():
+            for index, spec in enumerate(specs):
+                filename = zip_entry_name(index, spec, fmt)
+                try:
+                    if not isinstance(spec, dict):
+                        raise ValueError('Card spec must be an object')
+                    yield index, filename, parse_card_params(spec), None
+                except Exception as e:
+                    yield index, filename, None, f'Invalid card spec: {e}'
+        
+        print(f"Batch Export - {len(specs)} cards, Format: {fmt}, Concurrency: {concurrency}")
+        
+        deadline = time.time() + SYNC_EXPORT_SECONDS
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        response = Response(stream_with_context(stream_batch_zip(jobs(), fmt, concurrency, deadline)),
+                            mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename=urdu_cards_{timestamp}.zip'
+        return response
     
     except Exception as e:
-        print(f"Preview error: {e}")
+        print(f"Batch export error: {e}")
         import traceback
         traceback.print_exc()
-        
         return jsonify({
-            'success': False, 
-            'error': f'Preview generation failed: {str(e)}',
-            'message': 'Please check your input and try again'
+            'success': False,
+            'error': f'Batch export failed: {str(e)}'
         }), 400
 
-@app.route('/export/jpg', methods=['POST'])
-def export_jpg():
-    """Export as high-quality JPG with improved error handling"""
+@app.route('/export/pdf/sheet', methods=['POST'])
+def export_pdf_sheet():
+    """Export many cards imposed n-up on A4/Letter sheets as one PDF"""
     try:
-        data = request.json
+        specs, options = read_batch_specs()
+        if not specs:
+            return jsonify({'success': False, 'error': 'No cards provided'}), 400
+        if len(specs) > BATCH_MAX_CARDS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many cards: {len(specs)} (maximum {BATCH_MAX_CARDS})'
+            }), 413
         
-        # Validate input data (same as preview)
-        text = data.get('text', 'نمونہ متن\nSample Text')
-        width = max(10, min(500, float(data.get('width', 100))))
-        height = max(10, min(500, float(data.get('height', 70))))
-        font_size = max(8, min(72, int(data.get('fontSize', 16))))
-        font_color = data.get('fontColor', '#000000')
-        bg_color = data.get('backgroundColor', '#FFFFFF')
-        alignment = data.get('alignment', 'right')
-        line_spacing = max(0, min(50, int(data.get('lineSpacing', 5))))
-        font_family = data.get('fontFamily', 'Noto Nastaliq Urdu')
-        
-        print(f"JPG Export - Size: {width}x{height}, Font: {font_family}")
-        
-        img = card_generator.create_card_image(
-            text=text,
-            width=width,
-            height=height,
-            font_size=font_size,
-            font_color=font_color,
-            bg_color=bg_color,
-            alignment=alignment,
-            line_spacing=line_spacing,
-            font_family=font_family,
-            dpi=300  # High DPI for export
-        )
+        page_size = options.get('pageSize', 'A4')
+        if page_size not in PAGE_SIZES:
+            return jsonify({'success': False, 'error': f'Page size must be one of {", ".join(PAGE_SIZES)}'}), 400
+        landscape = str(options.get('orientation', 'portrait')).lower() == 'landscape'
+        margin = max(0, min(50, float(options.get('margin', 10))))
+        gutter = max(0, min(50, float(options.get('gutter', 5))))
+        crop_marks = str(options.get('cropMarks', True)).lower() not in ('false', '0', 'no')
         
-        # Save as high-quality JPG
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"urdu_card_{timestamp}.jpg"
-        filepath = f"exports/{filename}"
+        cards = [parse_card_params(spec) for spec in specs]
         
-        # Ensure exports directory exists
-        os.makedirs('exports', exist_ok=True)
+        print(f"PDF Sheet Export - {len(cards)} cards, Page: {page_size}, Landscape: {landscape}")
         
-        # Convert to RGB if necessary and save with high quality
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        pdf_buffer = card_generator.create_imposed_pdf(
+            cards,
+            page_size=page_size,
+            landscape=landscape,
+            margin=margin,
+            gutter=gutter,
+            crop_marks=crop_marks
+        )
         
-        img.save(filepath, 'JPEG', quality=95, dpi=(300, 300), optimize=True)
+        font_bytes = embedded_font_bytes(pdf_buffer.getvalue())
+        print(f"PDF Sheet Export - {pdf_buffer.getbuffer().nbytes} bytes, embedded fonts: {font_bytes} bytes")
         
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        response = send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True,
+                             download_name=f"urdu_cards_sheet_{timestamp}.pdf")
+        response.headers['X-Embedded-Font-Bytes'] = str(font_bytes)
+        return response
     
     except Exception as e:
-        print(f"JPG Export error: {e}")
+        print(f"PDF sheet export error: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({
-            'success': False, 
-            'error': f'JPG export failed: {str(e)}'
-        }), 500
+            'success': False,
+            'error': f'PDF sheet export failed: {str(e)}'
+        }), 400
 
-@app.route('/export/pdf', methods=['POST'])
-def export_pdf():
-    """Export as PDF with improved error handling"""
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+class CardTemplate:
+    """A card design with {placeholders} rendered row by row over a cached static layer
+    
+    The background and the lines without placeholders are measured once.
+    They are drawn once per distinct line slot height, because the block
+    layout depends on the tallest line. Each row then only measures and
+    blits its variable lines onto a copy of that layer.
+    """
+
+    MAX_LAYERS = 8
+
+    def __init__(self, params, dpi=300, auto_fit=False):
+        self.params = params
+        self.dpi = dpi
+        self.auto_fit = auto_fit
+        self.lines = [line for line in params['text'].split('\n') if line.strip()]
+        self.variable = [i for i, line in enumerate(self.lines) if PLACEHOLDER_PATTERN.search(line)]
+        if not self.variable:
+            raise ValueError('Template text has no {placeholders}')
+        self.fields = sorted({name for line in self.lines for name in PLACEHOLDER_PATTERN.findall(line)})
+        
+        self.layout = card_generator.layout_card(params['text'], params['width'], params['height'],
+                                                 params['font_size'], params['alignment'],
+                                                 params['line_spacing'], params['font_family'], dpi,
+                                                 params.get('padding'))
+        self.static_boxes = {i: placement[3] for i, placement in enumerate(self.layout['placements'])
+                             if i not in self.variable}
+        self.bg_rgb = card_generator.hex_to_rgb(params['bg_color'])
+        self.font_rgb = card_generator.hex_to_rgb(params['font_color'])
+        self._layers = {}
+    
+    def fill(self, line, row):
+        """Replace the placeholders of one line with row values, normalising line breaks to \\n"""
+        def value(match):
+            name = match.group(1)
+            if name not in row:
+                raise ValueError(f'Missing field "{name}"')
+            return '' if row[name] is None else str(row[name]).replace('\r\n', '\n').replace('\r', '\n')
+        return PLACEHOLDER_PATTERN.sub(value, line)
+    
+    def row_lines(self, row):
+        """Template lines filled from row, or None if the row needs its own layout
+        
+        That is the case for auto-fit templates, whose size and wrapping
+        depend on each row, and when a blank value or a line break in a
+        value changes the line count.
+        """
+        if self.auto_fit:
+            return None
+        lines = list(self.lines)
+        for i in self.variable:
+            lines[i] = self.fill(lines[i], row)
+            if not lines[i].strip() or '\n' in lines[i]:
+                return None
+        return lines
+    
+    def row_params(self, row):
+        """Card parameters for one row, for rendering from scratch"""
+        text = '\n'.join(self.fill(line, row) for line in self.params['text'].split('\n'))
+        if self.auto_fit:
+            return fit_card_params(dict(self.params, text=text))
+        return dict(self.params, text=text)
+    
+    def static_layer(self, placements, slot):
+        """Background plus static lines for a line slot height, rendered on first use"""
+        layer = self._layers.get(slot)
+        if layer is None:
+            if len(self._layers) >= self.MAX_LAYERS:
+                self._layers.clear()
+            layer = Image.new('RGB', (self.layout['width'], self.layout['height']), self.bg_rgb)
+            static = [placements[i] for i in self.static_boxes]
+            card_generator.draw_card_lines(ImageDraw.Draw(layer), dict(self.layout, placements=static),
+                                           self.font_rgb)
+            self._layers[slot] = layer
+        return layer
+    
+    def render_image(self, row):
+        """Render one row as an image"""
+        lines = self.row_lines(row)
+        if lines is None:
+            return card_generator.create_card_image(dpi=self.dpi, **self.row_params(row))
+        
+        layout = self.layout
+        variable_lines = [lines[i] for i in self.variable]
+        boxes = dict(self.static_boxes)
+        boxes.update(zip(self.variable, card_generator.measure_lines(
+            layout['font'], variable_lines, layout['font_size_px'])))
+        placements = card_generator.place_lines(
+            lines, [boxes[i] for i in range(len(lines))], layout['width'], layout['height'],
+            layout['font_size_px'], self.params['alignment'], layout['line_spacing_px'],
+            layout['padding_px'])
+        slot = max(bbox[3] - bbox[1] for bbox in boxes.values())
+        
+        with timed('draw'):
+            img = self.static_layer(placements, slot).copy()
+            variable = [placements[i] for i in self.variable]
+            card_generator.draw_card_lines(ImageDraw.Draw(img), dict(layout, placements=variable),
+                                           self.font_rgb)
+        return img
+    
+    def render_bytes(self, row, fmt):
+        """Render and encode one row as JPEG or PNG bytes"""
+        img = self.render_image(row)
+        buffer = io.BytesIO()
+        with timed(f'encode_{fmt}'):
+            if fmt == 'png':
+                img.save(buffer, 'PNG', dpi=(self.dpi, self.dpi))
+            else:
+                img.save(buffer, 'JPEG', quality=95, dpi=(self.dpi, self.dpi), optimize=True)
+        return buffer.getvalue()
+    
+    def create_pdf(self, rows, deadline=None):
+        """One PDF page per row; returns (buffer, failures)
+        
+        The static layer is drawn once into a form XObject that every page
+        references, so only the variable lines are written per page. Rows
+        left when the deadline passes are reported as failures.
+        """
+        load_reportlab()
+        params = self.params
+        page_width = float(params['width']) * MM_TO_POINTS
+        page_height = float(params['height']) * MM_TO_POINTS
+        buffer = io.BytesIO()
+        c = pdf_canvas.Canvas(buffer, pagesize=(page_width, page_height))
+        
+        with timed('pdf_font'):
+            font_name = card_generator.register_pdf_font(params['font_family'])
+        
+        style = (params['font_size'], params['font_color'], params['bg_color'],
+                 params['alignment'], params['line_spacing'], font_name)
+        padding = params.get('padding')
+        variable = set(self.variable)
+        failures = []
+        
+        with timed('pdf_draw'):
+            if not self.auto_fit:
+                c.beginForm('static_layer')
+                card_generator.draw_pdf_card(c, page_width, page_height, params['text'], *style,
+                                             line_filter=lambda i: i not in variable,
+                                             padding=padding)
+                c.endForm()
+            
+            for index, row in enumerate(rows):
+                if deadline is not None and time.time() >= deadline:
+                    failures.append({'index': index, 'error': time_limit_error('rows')})
+                    continue
+                try:
+                    lines = self.row_lines(row)
+                    if lines is None:
+                        row_params = self.row_params(row)
+                        card_generator.draw_pdf_card(c, page_width, page_height, row_params['text'],
+                                                     row_params['font_size'], *style[1:],
+                                                     padding=padding)
+                    else:
+                        c.doForm('static_layer')
+                        card_generator.draw_pdf_card(c, page_width, page_height, '\n'.join(lines),
+                                                     *style, background=False,
+                                                     line_filter=lambda i: i in variable,
+                                                     padding=padding)
+                    c.showPage()
+                except Exception as e:
+                    failures.append({'index': index, 'error': str(e)})
+        
+        with timed('pdf_save'):
+            c.save()
+        buffer.seek(0)
+        return buffer, failures
+
+def stream_merge_zip(template, rows, fmt, deadline):
+    """Render merge rows one by one and yield a ZIP as they complete
+    
+    Rows left when the deadline passes are reported in summary.json
+    instead of rendered, so the worker is never killed mid-archive.
+    """
+    over_time = time_limit_error('rows')
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w')
+    failures = []
+    succeeded = 0
+    nbytes = estimate_card_bytes(template.params, fmt, template.dpi) * 2
+    
+    for index, row in enumerate(rows):
+        filename = zip_entry_name(index, row, fmt)
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('Row must be an object')
+            if time.time() >= deadline:
+                raise ValueError(over_time)
+            with admission.admit('export_merge', nbytes):
+                data = template.render_bytes(row, fmt)
+            write_zip_entry(archive, filename, data)
+            succeeded += 1
+        except Exception as e:
+            failures.append({'index': index, 'filename': filename, 'error': str(e)})
+        
+        data = stream.drain()
+        if data:
+            yield data
+    
+    write_zip_summary(archive, succeeded, failures)
+    archive.close()
+    yield stream.drain()
+
+@app.route('/export/merge', methods=['POST'])
+def export_merge():
+    """Mail merge: render a {placeholder} card design once per data row
+    
+    Takes JSON {"template": {...card...}, "rows": [...]} or a multipart
+    upload of a CSV/JSONL data file with the template as a JSON form field.
+    jpg/png output streams a ZIP of per-row images; pdf returns one page
+    per row.
+    """
     try:
-        data = request.json
+        rows, options = read_batch_specs(key='rows')
+        template_spec = options.get('template')
+        if isinstance(template_spec, str):
+            template_spec = json.loads(template_spec)
+        if not isinstance(template_spec, dict):
+            return jsonify({'success': False, 'error': 'A card template object is required'}), 400
         
-        # Validate input data
-        text = data.get('text', 'نمونہ متن\nSample Text')
-        width = max(10, min(500, float(data.get('width', 100))))
-        height = max(10, min(500, float(data.get('height', 70))))
-        font_size = max(8, min(72, int(data.get('fontSize', 16))))
-        font_color = data.get('fontColor', '#000000')
-        bg_color = data.get('backgroundColor', '#FFFFFF')
-        alignment = data.get('alignment', 'right')
-        line_spacing = max(0, min(50, int(data.get('lineSpacing', 5))))
-        font_family = data.get('fontFamily', 'Noto Nastaliq Urdu')
-        
-        print(f"PDF Export - Size: {width}x{height}, Font: {font_family}")
-        
-        pdf_buffer = card_generator.create_pdf(
-            text=text,
-            width=width,
-            height=height,
-            font_size=font_size,
-            font_color=font_color,
-            bg_color=bg_color,
-            alignment=alignment,
-            line_spacing=line_spacing,
-            font_family=font_family
-        )
+        fmt = str(options.get('format', 'jpg')).lower()
+        if fmt not in ('jpg', 'png', 'pdf'):
+            return jsonify({'success': False, 'error': 'Format must be jpg, png or pdf'}), 400
+        if not rows:
+            return jsonify({'success': False, 'error': 'No rows provided'}), 400
+        if len(rows) > BATCH_MAX_CARDS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many rows: {len(rows)} (maximum {BATCH_MAX_CARDS})'
+            }), 413
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"urdu_card_{timestamp}.pdf"
-        filepath = f"exports/{filename}"
+        template = CardTemplate(parse_card_params(template_spec, fit=False),
+                                auto_fit=auto_fit_requested(template_spec))
         
-        # Ensure exports directory exists
-        os.makedirs('exports', exist_ok=True)
+        print(f"Merge Export - {len(rows)} rows, Fields: {', '.join(template.fields)}, Format: {fmt}")
         
-        with open(filepath, 'wb') as f:
-            f.write(pdf_buffer.getvalue())
+        deadline = time.time() + SYNC_EXPORT_SECONDS
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if fmt == 'pdf':
+            pdf_buffer, failures = template.create_pdf(
+                [row if isinstance(row, dict) else {} for row in rows], deadline=deadline)
+            response = send_export(pdf_buffer.getvalue(), f"urdu_cards_merge_{timestamp}.pdf",
+                                   'application/pdf')
+            response.headers['X-Merge-Failed'] = str(len(failures))
+            if failures:
+                response.headers['X-Merge-Failed-Rows'] = ','.join(str(f['index']) for f in failures[:100])
+            return response
         
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        response = Response(stream_with_context(stream_merge_zip(template, rows, fmt, deadline)),
+                            mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename=urdu_cards_merge_{timestamp}.zip'
+        return response
     
+    except AdmissionRejected as e:
+        return admission_response(e)
     except Exception as e:
-        print(f"PDF Export error: {e}")
+        print(f"Merge export error: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({
-            'success': False, 
-            'error': f'PDF export failed: {str(e)}'
-        }), 500
+            'success': False,
+            'error': f'Merge export failed: {str(e)}'
+        }), 400
 
-@app.route('/export_pdf', methods=['POST'])
-def export_canvas_pdf():
-    """Export canvas as high-resolution PDF"""
+class MemoryEstimate:
+    """Accounts for the large buffers a request holds to estimate its peak memory (not measured)"""
+
+    def __init__(self):
+        self._held = {}
+        self.current = 0
+        self.peak = 0
+
+    def hold(self, name, nbytes):
+        self.release(name)
+        self._held[name] = nbytes
+        self.current += nbytes
+        self.peak = max(self.peak, self.current)
+
+    def release(self, name):
+        self.current -= self._held.pop(name, 0)
+
+def image_bytes(image):
+    """Decoded size of a PIL image in bytes"""
+    return image.width * image.height * len(image.getbands())
+
+def read_canvas_upload():
+    """Return (seekable image file, width mm, height mm, dpi, options) from a binary, multipart or JSON upload"""
+    image_file, options = read_canvas_file()
     try:
-        data = request.json
+        width = max(10, min(500, float(options.get('width', 100))))
+        height = max(10, min(500, float(options.get('height', 70))))
+        dpi = max(72, min(2400, int(options.get('dpi', 1200))))  # Support high DPI from frontend
+    except (TypeError, ValueError):
+        image_file.close()
+        raise ValueError('width, height and dpi must be numbers')
+    return image_file, width, height, dpi, options
+
+def read_canvas_file():
+    """Return (seekable image file, options) from a binary, multipart or JSON upload"""
+    content_type = request.mimetype or ''
+    
+    if content_type == 'multipart/form-data':
+        upload = request.files.get('canvas') or request.files.get('file')
+        if upload is None:
+            raise ValueError('No canvas file provided')
+        return upload.stream, request.form
+    
+    if content_type == 'application/json':
+        data = request.get_json()
         canvas_data = data.get('canvas_data', '')
-        width = data.get('width', 100)
-        height = data.get('height', 70)
-        dpi = data.get('dpi', 1200)  # Support high DPI from frontend
-        
         if not canvas_data:
-            return jsonify({'error': 'No canvas data provided'}), 400
-        
+            raise ValueError('No canvas data provided')
         # Remove data URL prefix
-        if canvas_data.startswith('data:image/png;base64,'):
-            canvas_data = canvas_data[22:]
-        elif canvas_data.startswith('data:image/jpeg;base64,'):
-            canvas_data = canvas_data[23:]
+        if canvas_data.startswith('data:'):
+            canvas_data = canvas_data.split(',', 1)[-1]
+        return io.BytesIO(base64.b64decode(canvas_data)), data
+    
+    # Raw application/octet-stream or image/* body; options in the query string
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    shutil.copyfileobj(request.stream, spool, 1024 * 1024)
+    if spool.tell() == 0:
+        raise ValueError('No canvas data provided')
+    spool.seek(0)
+    return spool, request.args
+
+def estimate_canvas_bytes(image_file):
+    """Estimated peak memory of embedding an uploaded canvas, from its header only"""
+    image = Image.open(image_file)
+    try:
+        image_file.seek(0, os.SEEK_END)
+        upload = image_file.tell()
+        if image.format == 'JPEG' and image.mode in ('RGB', 'L', 'CMYK'):
+            return upload * 2
+        # Decoded pixels, a flattened RGB copy and ReportLab's raw RGB data
+        return upload + image.width * image.height * (4 + 4 + 3)
+    finally:
+        image_file.seek(0)
+
+def create_canvas_pdf(image_file, width, height, dpi, memory):
+    """Embed an uploaded canvas image in a PDF page of width x height mm
+    
+    JPEG uploads are copied into the PDF as-is (DCT passthrough); other
+    formats are decoded once and stored losslessly with Flate.
+    """
+    load_reportlab()
+    image_file.seek(0, os.SEEK_END)
+    upload_bytes = image_file.tell()
+    memory.hold('upload', upload_bytes)
+    image_file.seek(0)
+    
+    # Only the header is read here; pixels are decoded lazily
+    image = Image.open(image_file)
+    
+    pdf_buffer = io.BytesIO()
+    page_width = width * MM_TO_POINTS
+    page_height = height * MM_TO_POINTS
+    c = pdf_canvas.Canvas(pdf_buffer, pagesize=(page_width, page_height))
+    
+    if image.format == 'JPEG' and image.mode in ('RGB', 'L', 'CMYK'):
+        # ReportLab embeds the original JPEG bytes as DCTDecode
+        image_file.seek(0)
+        memory.hold('pdf_image', upload_bytes)
+        with timed('pdf_embed'):
+            c.drawImage(ImageReader(image_file), 0, 0, page_width, page_height)
+    else:
+        with timed('decode'):
+            image.load()
+        memory.hold('decoded', image_bytes(image))
+        
+        if image.mode in ('RGBA', 'LA'):
+            alpha = image.getchannel('A')
+            if alpha.getextrema() == (255, 255):
+                # Fully opaque canvas, the alpha channel can simply be dropped
+                image = image.convert('RGB' if image.mode == 'RGBA' else 'L')
+            else:
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=alpha)
+                image = background
+            del alpha
+            memory.hold('flattened', image_bytes(image))
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+            memory.hold('flattened', image_bytes(image))
         
-        # Decode base64 image
+        # ImageReader keeps one raw RGB copy that ReportLab Flate-compresses
+        memory.hold('pdf_image', image.width * image.height * 3)
+        with timed('pdf_embed'):
+            c.drawImage(ImageReader(image), 0, 0, page_width, page_height)
+    
+    with timed('pdf_save'):
+        c.save()
+    memory.hold('pdf', pdf_buffer.getbuffer().nbytes)
+    pdf_buffer.seek(0)
+    return pdf_buffer
+
+@app.route('/export_pdf', methods=['POST'])
+def export_canvas_pdf():
+    """Export canvas as high-resolution PDF
+    
+    Accepts the canvas as a multipart file field ("canvas"), a raw
+    application/octet-stream or image/* body with width, height and dpi in
+    the query string, or the older JSON body with a base64 data URL.
+    """
+    try:
         try:
-            image_data = base64.b64decode(canvas_data)
-            image = Image.open(io.BytesIO(image_data))
+            with timed('upload'):
+                image_file, width, height, dpi, _ = read_canvas_upload()
         except Exception as e:
             return jsonify({'error': f'Invalid image data: {str(e)}'}), 400
         
-        # Create PDF
-        pdf_buffer = io.BytesIO()
+        memory = MemoryEstimate()
+        try:
+            with admission.admit('export_canvas_pdf', estimate_canvas_bytes(image_file)):
+                pdf_buffer = create_canvas_pdf(image_file, width, height, dpi, memory)
+        except (Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+            return jsonify({'error': f'Invalid image data: {str(e)}'}), 400
+        except AdmissionRejected as e:
+            return admission_response(e)
+        finally:
+            image_file.close()
+        
+        print(f"Canvas PDF Export - {width}x{height}mm @ {dpi}dpi, "
+              f"{pdf_buffer.getbuffer().nbytes} bytes, estimated peak memory {memory.peak} bytes")
         
-        # Convert mm to points (1 mm = 2.83465 points)
-        mm_to_points = 2.83465
-        page_width = width * mm_to_points
-        page_height = height * mm_to_points
+        response = make_response(pdf_buffer.getvalue())
+        response.headers['Content-Type'] = 'application/pdf'
+        response.headers['Content-Disposition'] = f'attachment; filename=urdu-card-{width:g}x{height:g}mm-{dpi}dpi.pdf'
+        response.headers['X-Peak-Memory-Estimate'] = str(memory.peak)
         
-        # Create PDF document
-        c = pdf_canvas.Canvas(pdf_buffer, pagesize=(page_width, page_height))
+        return response
         
-        # Save image to temporary buffer
-        img_buffer = io.BytesIO()
-        # Convert to RGB if needed (for JPEG compatibility)
-        if image.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = background
+    except Exception as e:
+        print(f"Canvas PDF export error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
+
+def scene_direction(text):
+    """Base direction of a line of scene text"""
+    return 'RTL' if RTL_PATTERN.search(text) else 'LTR'
+
+def parse_scene_request(data):
+    """Return (scene, format, dpi) from a scene export payload"""
+    scene = parse_scene(data)
+    fmt = str(data.get('format', 'pdf')).lower()
+    if fmt not in ('pdf', 'png', 'jpg'):
+        raise ValueError('Format must be pdf, png or jpg')
+    if (fmt == 'pdf' and not PDF_TEXT_SHAPING and
+            any(RTL_PATTERN.search(element['text']) for element in scene['textElements'])):
+        raise ValueError('Vector PDF export of Urdu text needs ReportLab shaping support '
+                         '(reportlab[shaping,bidi]); export PNG or JPG instead')
+    dpi = max(72, min(1200, int(data.get('dpi', 300))))
+    return scene, fmt, dpi
+
+def estimate_scene_bytes(scene, fmt, dpi):
+    """Estimated peak memory of rendering a scene: the page plus element layers
+    
+    Elements are drawn one at a time, so the largest element counts. Its
+    layer is sized as create_scene_image sizes it. The shadow mask and its
+    blurred copy, the opacity pass and the expanded rotated copy are added
+    when the element uses them.
+    """
+    if fmt == 'pdf':
+        return 4 * 1024 * 1024
+    scale = dpi / scene['sceneDpi']
+    img_width = max(1, int(round(scene['width'] * dpi / 25.4)))
+    img_height = max(1, int(round(scene['height'] * dpi / 25.4)))
+    
+    largest = 0
+    for element in scene['textElements']:
+        font, placed = card_generator.scene_element_lines(element, scale)
+        if not placed:
+            continue
+        extent = card_generator.scene_layer_extent(element, font, placed, scale, img_width, img_height)
+        side_pixels = (2 * extent) ** 2
+        element_bytes = side_pixels * 4
+        if element['shadowBlur'] > 0:
+            element_bytes += side_pixels * 2
+        if element['opacity'] < 100:
+            element_bytes += side_pixels * 2
+        if element['rotation']:
+            # expand=True grows the square by up to a factor of two in area, and
+            # RGBA is rotated through a premultiplied copy on each side
+            element_bytes += side_pixels * 16
+        largest = max(largest, element_bytes)
+    return img_width * img_height * 4 * 2 + largest
+
+def render_scene_bytes(scene, fmt, dpi):
+    """Return (bytes, mimetype, filename) for a rendered scene"""
+    size = f"{scene['width']:g}x{scene['height']:g}mm"
+    if fmt == 'pdf':
+        pdf_buffer = card_generator.create_scene_pdf(scene)
+        return pdf_buffer.getvalue(), 'application/pdf', f"urdu-card-{size}.pdf"
+    
+    img = card_generator.create_scene_image(scene, dpi)
+    buffer = io.BytesIO()
+    with timed(f'encode_{fmt}'):
+        if fmt == 'png':
+            img.save(buffer, format='PNG', dpi=(dpi, dpi))
+            mimetype = 'image/png'
+        else:
+            img.save(buffer, 'JPEG', quality=95, dpi=(dpi, dpi))
+            mimetype = 'image/jpeg'
+    return buffer.getvalue(), mimetype, f"urdu-card-{size}-{dpi}dpi.{fmt}"
+
+@app.route('/export/scene', methods=['POST'])
+def export_scene():
+    """Render a canvas-pro scene on the server as a vector PDF or a raster image"""
+    try:
+        try:
+            scene, fmt, dpi = parse_scene_request(request.json)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        image.save(img_buffer, format='JPEG', quality=95, dpi=(dpi, dpi))
-        img_buffer.seek(0)
+        print(f"Scene Export - {len(scene['textElements'])} elements, "
+              f"Size: {scene['width']}x{scene['height']}, Format: {fmt}")
         
-        # Add image to PDF
-        c.drawImage(ImageReader(img_buffer), 0, 0, page_width, page_height)
-        c.save()
+        with admission.admit('export_scene', estimate_scene_bytes(scene, fmt, dpi)):
+            data, mimetype, filename = render_scene_bytes(scene, fmt, dpi)
+        return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True,
+                         download_name=filename)
+    
+    except AdmissionRejected as e:
+        return admission_response(e)
+    except Exception as e:
+        print(f"Scene export error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'Scene export failed: {str(e)}'
+        }), 400
+
+class QueueFull(Exception):
+    """Raised when the export job backlog is at capacity"""
+
+    def __init__(self, retry_after):
+        super().__init__('Export queue is full')
+        self.retry_after = retry_after
+
+class JobStore:
+    """Export job records and results in SQLite, shared by all worker processes
+    
+    A job runs in the worker process that accepted it, but any worker can
+    report its status and serve its result. Finished jobs are kept for
+    result_ttl seconds. Stored results are capped at max_bytes in total by
+    dropping the oldest finished jobs first.
+    """
+
+    def __init__(self, store_dir=JOB_STORE_DIR, result_ttl=JOB_RESULT_TTL, max_bytes=JOB_RESULT_BYTES):
+        self.path = os.path.join(store_dir, 'jobs.sqlite3')
+        self.result_ttl = result_ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connect(self):
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+                     'lane TEXT NOT NULL, status TEXT NOT NULL, owner INTEGER NOT NULL, '
+                     'created REAL NOT NULL, started REAL, finished REAL, error TEXT, '
+                     'data BLOB, mimetype TEXT, filename TEXT, size INTEGER NOT NULL DEFAULT 0)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job):
+        self._connect().execute(
+            'INSERT INTO jobs (id, kind, lane, status, owner, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (job['id'], job['kind'], job['lane'], job['status'], os.getpid(), job['created']))
+
+    def start(self, job_id):
+        self._connect().execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                                (time.time(), job_id))
+
+    def finish(self, job_id, status, error=None, result=None):
+        """Record a finished job; a result over the whole byte cap fails the job instead"""
+        data, mimetype, filename = result if result is not None else (None, None, None)
+        if data is not None and len(data) > self.max_bytes:
+            status, data = 'failed', None
+            error = (f'Result of {len(result[0]) / 2 ** 20:.1f} MB is over the '
+                     f'{self.max_bytes / 2 ** 20:.1f} MB job result limit')
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE jobs SET status = ?, error = ?, finished = ?, data = ?, mimetype = ?, '
+                         'filename = ?, size = ? WHERE id = ?',
+                         (status, error, time.time(), None if data is None else sqlite3.Binary(data),
+                          mimetype, filename, len(data) if data is not None else 0, job_id))
+            self._expire(conn)
+        return status, error
+
+    def _expire(self, conn):
+        """Drop expired jobs, then the oldest results until the total fits (inside a write transaction)"""
+        conn.execute('DELETE FROM jobs WHERE finished < ?', (time.time() - self.result_ttl,))
+        excess = conn.execute('SELECT COALESCE(SUM(size), 0) FROM jobs').fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for job_id, size in conn.execute('SELECT id, size FROM jobs WHERE size > 0 ORDER BY finished'):
+            victims.append((job_id,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM jobs WHERE id = ?', victims)
+
+    def get(self, job_id):
+        """Status record of a job, or None if unknown or expired"""
+        row = self._connect().execute(
+            'SELECT id, kind, lane, status, owner, created, finished, error FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'kind', 'lane', 'status', 'owner', 'created', 'finished', 'error'), row))
+        if job['status'] in ('queued', 'running') and not pid_alive(job['owner']):
+            job.update(status='failed', error='The worker process running this job exited')
+        return job
+
+    def result(self, job_id):
+        """(data, mimetype, filename) of a finished job, or None"""
+        row = self._connect().execute(
+            "SELECT data, mimetype, filename FROM jobs WHERE id = ? AND status = 'done'",
+            (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return bytes(row[0]), row[1], row[2]
+
+    def stats(self):
+        stored, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM jobs').fetchone()
+        return {'stored': stored, 'result_bytes': size, 'result_max_bytes': self.max_bytes}
+
+def pid_alive(pid):
+    """Whether a process with this pid exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobQueue:
+    """In-process export job queue with priority lanes and a bounded backlog
+    
+    Jobs run on a small pool of worker threads. The 'interactive' lane is
+    always dequeued before 'bulk', and bulk jobs also hold back while
+    previews are being rendered in this process. Job records and results
+    live in a JobStore, so any worker process can answer for them.
+    """
+
+    LANES = {'interactive': 0, 'bulk': 1}
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_QUEUE_SIZE, store=None):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.store = store or JobStore()
+        self._queue = queue.PriorityQueue()
+        self._runs = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = 0
+        self._foreground = 0
+        self._pid = None
+        self._avg_seconds = 1.0
+
+    def _ensure_workers(self):
+        # Threads do not survive fork, so start them lazily in each worker process
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'export-job-{i}', daemon=True).start()
+
+    def submit(self, kind, run, lane='bulk'):
+        """Queue run() and return the job record; raises QueueFull at capacity"""
+        priority = self.LANES.get(lane, self.LANES['bulk'])
+        with self._lock:
+            if self._pending >= self.max_pending:
+                waves = math.ceil(self._pending / self.workers)
+                raise QueueFull(max(1, min(60, math.ceil(waves * self._avg_seconds))))
+            self._ensure_workers()
+            job = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'lane': lane if lane in self.LANES else 'bulk',
+                'status': 'queued',
+                'created': time.time(),
+                'error': None,
+            }
+            self.store.create(job)
+            self._runs[job['id']] = (kind, run)
+            self._pending += 1
+            self._queue.put((priority, next(self._seq), job['id']))
+            return job
+
+    def _work(self):
+        while True:
+            priority, _, job_id = self._queue.get()
+            with self._lock:
+                kind, run = self._runs.pop(job_id)
+                # Previews beat bulk exports; wait a bounded time to avoid starvation
+                if priority > 0:
+                    self._changed.wait_for(lambda: self._foreground == 0, timeout=5)
+            
+            started = time.time()
+            try:
+                self.store.start(job_id)
+                with timed(f"job_{kind}"):
+                    result = run()
+                status, error = 'done', None
+            except Exception as e:
+                print(f"Export job {job_id} failed: {e}")
+                result, status, error = None, 'failed', str(e)
+            
+            try:
+                status, error = self.store.finish(job_id, status, error, result)
+            except sqlite3.Error as e:
+                print(f"Export job {job_id} could not be stored: {e}")
+                status = 'failed'
+            del result
+            
+            with self._lock:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.time() - started)
+                self._pending -= 1
+            metrics.inc('urdu_card_jobs_total', 'Finished export jobs by kind and status.',
+                        {'kind': kind, 'status': status})
+
+    @contextmanager
+    def foreground(self):
+        """Mark an interactive request so bulk jobs hold back while it runs"""
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                self._changed.notify_all()
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def retry_after(self):
+        """Suggested seconds between status polls"""
+        with self._lock:
+            return max(1, min(10, math.ceil(self._avg_seconds)))
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'pending': self._pending,
+                'capacity': self.max_pending,
+                'workers': self.workers,
+            }
+        try:
+            stats.update(self.store.stats())
+        except sqlite3.Error as e:
+            print(f"Job store stats error: {e}")
+        return stats
+
+job_queue = JobQueue()
+
+def job_status(job):
+    """Public JSON view of a job record"""
+    return {
+        'success': job['status'] != 'failed',
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'lane': job['lane'],
+        'status': job['status'],
+        'error': job['error'],
+        'status_url': f"/jobs/{job['id']}",
+        'result_url': f"/jobs/{job['id']}/result",
+    }
+
+def queue_job(kind, run, lane):
+    """Submit a job and build the 202 response (or 429 when the queue is full)"""
+    try:
+        job = job_queue.submit(kind, run, lane)
+    except QueueFull as e:
+        response = jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    response = jsonify(job_status(job))
+    response.status_code = 202
+    response.headers['Location'] = f"/jobs/{job['id']}"
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a card (jpg/pdf) or scene export and return its job id"""
+    try:
+        data = request.json
+        kind = str(data.get('type', 'jpg')).lower()
+        lane = str(data.get('lane', 'bulk')).lower()
+        
+        if kind in ('jpg', 'pdf'):
+            params = parse_card_params(data)
+            dpi = 300 if kind == 'jpg' else None
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            mimetype = 'image/jpeg' if kind == 'jpg' else 'application/pdf'
+            
+            def run():
+                _, output = cached_card_bytes(params, kind, dpi=dpi, route='job',
+                                              admit_timeout=JOB_ADMISSION_TIMEOUT)
+                return output, mimetype, f"urdu_card_{timestamp}.{kind}"
+        elif kind == 'scene':
+            scene, fmt, dpi = parse_scene_request(data)
+            
+            def run():
+                with admission.admit('job', estimate_scene_bytes(scene, fmt, dpi), timeout=JOB_ADMISSION_TIMEOUT):
+                    return render_scene_bytes(scene, fmt, dpi)
+        else:
+            return jsonify({'success': False, 'error': 'Job type must be jpg, pdf or scene'}), 400
         
-        pdf_buffer.seek(0)
+        return queue_job(kind, run, lane)
+    
+    except Exception as e:
+        print(f"Job submit error: {e}")
+        return jsonify({'success': False, 'error': f'Job submission failed: {str(e)}'}), 400
+
+@app.route('/jobs/canvas_pdf', methods=['POST'])
+def submit_canvas_pdf_job():
+    """Queue a canvas PDF export; accepts the same bodies as /export_pdf"""
+    try:
+        image_file, width, height, dpi, options = read_canvas_upload()
+        lane = str(options.get('lane', 'bulk')).lower()
         
-        response = make_response(pdf_buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename=urdu-card-{width}x{height}mm-{dpi}dpi.pdf'
+        # Request-owned upload streams are closed after the response
+        upload = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        shutil.copyfileobj(image_file, upload, 1024 * 1024)
+        image_file.close()
         
+        def run():
+            try:
+                with admission.admit('job', estimate_canvas_bytes(upload), timeout=JOB_ADMISSION_TIMEOUT):
+                    pdf_buffer = create_canvas_pdf(upload, width, height, dpi, MemoryEstimate())
+            finally:
+                upload.close()
+            return pdf_buffer.getvalue(), 'application/pdf', f"urdu-card-{width:g}x{height:g}mm-{dpi}dpi.pdf"
+        
+        return queue_job('canvas_pdf', run, lane)
+    
+    except Exception as e:
+        print(f"Job submit error: {e}")
+        return jsonify({'success': False, 'error': f'Job submission failed: {str(e)}'}), 400
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status from any worker; unfinished jobs carry a Retry-After polling hint
+    
+    Status requests never block: a long-poll would hold a whole sync worker
+    and stall previews.
+    """
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+        response = jsonify(job_status(job))
+        if job['status'] in ('queued', 'running'):
+            response.headers['Retry-After'] = str(job_queue.retry_after())
         return response
+    except Exception as e:
+        print(f"Job status error: {e}")
+        return jsonify({'success': False, 'error': f'Job status failed: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    """Download a finished job's output"""
+    try:
+        job = job_queue.get(job_id)
+        result = job_queue.store.result(job_id) if job is not None and job['status'] == 'done' else None
+        if job is None or (job['status'] == 'done' and result is None):
+            return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+        if job['status'] == 'failed':
+            return jsonify(job_status(job)), 500
+        if job['status'] != 'done':
+            response = jsonify(job_status(job))
+            response.status_code = 202
+            response.headers['Retry-After'] = str(job_queue.retry_after())
+            return response
         
+        data, mimetype, filename = result
+        return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True, download_name=filename)
     except Exception as e:
-        print(f"Canvas PDF export error: {str(e)}")
+        print(f"Job result error: {e}")
+        return jsonify({'success': False, 'error': f'Job result failed: {str(e)}'}), 500
+
+class WebfontBuilder:
+    """Subsetted WOFF2 builds of the catalog fonts for the canvas editors
+    
+    Every font gets a 'core' Urdu/Latin subset, built ahead of time, plus
+    subsets for rarer Unicode ranges built on first request. The browser
+    only downloads a subset when a page uses a character from its
+    unicode-range. Files are named by a hash of the source font and the
+    subset, so URLs change with the content and can be cached forever.
+    
+    Without fontTools the whole font file is served instead, still under a
+    content-hashed URL.
+    """
+
+    SUBSETS = OrderedDict([
+        ('core', 'U+0000-00FF, U+0600-06FF, U+0750-077F, U+200C-200F, U+2010-2027, '
+                 'U+2039-203A, U+FFFD'),
+        # Presentation forms are only typed by legacy input; shaping reaches
+        # the same glyphs through GSUB from the base letters in 'core'
+        ('arabic-pres', 'U+FB50-FDFF, U+FE70-FEFF'),
+        ('arabic-ext', 'U+0870-08FF, U+10E60-10E7F, U+1EE00-1EEFF'),
+        ('latin-ext', 'U+0100-024F, U+1E00-1EFF, U+2000-200B, U+2028-2038, U+203B-20CF, U+2100-218F'),
+    ])
+    FORMATS = {'woff2': 'woff2', 'woff': 'woff', '.ttf': 'truetype', '.otf': 'opentype'}
+
+    def __init__(self, cache_dir=WEBFONT_DIR):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._fonts = {}
+        self.builds = 0
+
+    def fonts(self):
+        """{font hash: catalog entry} for the current catalog, hashed once per catalog"""
+        with self._lock:
+            if self._fingerprint != font_registry.fingerprint:
+                fonts = {}
+                for entry in font_registry.entries():
+                    if entry['source'] != 'bundled':
+                        continue
+                    with open(entry['path'], 'rb') as f:
+                        font_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+                    fonts[font_hash] = entry
+                self._fonts = fonts
+                self._fingerprint = font_registry.fingerprint
+            return self._fonts
+
+    def subsets(self):
+        """Subset names this server builds: all of them, or just the whole font"""
+        return list(self.SUBSETS) if font_subset is not None else ['core']
+
+    def filename(self, font_hash, subset):
+        entry = self.fonts()[font_hash]
+        if font_subset is None:
+            ext = os.path.splitext(entry['file'])[1].lower()
+        else:
+            ext = '.' + WEBFONT_FLAVOR
+        # The builder's options are part of the content, so they are part of the name
+        name_hash = hashlib.sha256(f'{font_hash}:{subset}:{ext}:{self.SUBSETS[subset]}'.encode()).hexdigest()[:16]
+        return f'{font_hash}-{subset}-{name_hash}{ext}'
+
+    def path(self, filename):
+        """Local file for a webfont name, building it on first use; None if unknown"""
+        match = re.fullmatch(r'([0-9a-f]{16})-([a-z-]+)-[0-9a-f]{16}(\.\w+)', filename)
+        if not match or match.group(2) not in self.subsets():
+            return None
+        font_hash, subset = match.group(1), match.group(2)
+        if font_hash not in self.fonts() or self.filename(font_hash, subset) != filename:
+            return None
+        
+        target = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(target):
+            card_generator.single_flight(f'webfont:{filename}',
+                                         lambda: self.build(self.fonts()[font_hash], subset, target))
+        return target
+
+    def build(self, entry, subset, target):
+        """Write one subset atomically, so other workers never see a partial file"""
+        if os.path.exists(target):
+            return
+        started = time.perf_counter()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if font_subset is None:
+                    with open(entry['path'], 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                else:
+                    options = font_subset.Options()
+                    options.flavor = WEBFONT_FLAVOR
+                    # Nastaliq joining and stacking live in the layout tables
+                    options.layout_features = ['*']
+                    options.hinting = False
+                    options.ignore_missing_unicodes = True
+                    font = font_subset.load_font(entry['path'], options)
+                    subsetter = font_subset.Subsetter(options)
+                    subsetter.populate(unicodes=font_subset.parse_unicodes(
+                        self.SUBSETS[subset].replace('U+', '')))
+                    subsetter.subset(font)
+                    font_subset.save_font(font, out, options)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.builds += 1
+        print(f"Built webfont {os.path.basename(target)} from {entry['file']} "
+              f"({os.path.getsize(target)} bytes, {time.perf_counter() - started:.2f}s)")
+
+    def build_core(self):
+        """Build the core subset of every font ahead of the first editor load"""
+        for font_hash in self.fonts():
+            try:
+                self.path(self.filename(font_hash, 'core'))
+            except Exception as e:
+                print(f"Webfont build error for {self.fonts()[font_hash]['file']}: {e}")
+
+    def stylesheet(self, url_for_file):
+        """@font-face rules for all catalog fonts and their subsets"""
+        rules = []
+        for font_hash, entry in self.fonts().items():
+            style = 'italic' if entry['italic'] else 'normal'
+            for subset in self.subsets():
+                filename = self.filename(font_hash, subset)
+                fmt = self.FORMATS.get(WEBFONT_FLAVOR if font_subset is not None
+                                       else os.path.splitext(filename)[1])
+                rule = [
+                    '@font-face {',
+                    f"  font-family: '{entry['family']}';",
+                    f'  font-style: {style};',
+                    f"  font-weight: {entry['weight']};",
+                    '  font-display: swap;',
+                    f"  src: url('{url_for_file(filename)}') format('{fmt}');",
+                ]
+                if font_subset is not None:
+                    rule.append(f'  unicode-range: {self.SUBSETS[subset]};')
+                rules.append('\n'.join(rule + ['}']))
+        return '\n'.join(rules) + '\n'
+
+webfonts = WebfontBuilder()
+
+@app.route('/webfonts.css')
+def webfonts_css():
+    """@font-face rules pointing at content-hashed webfont subsets"""
+    etag = f'{font_registry.fingerprint}-{WEBFONT_FLAVOR}-{font_subset is not None}'
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        css = webfonts.stylesheet(lambda filename: url_for('webfont', filename=filename))
+        response = Response(css, mimetype='text/css')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/webfonts/<filename>')
+def webfont(filename):
+    """Serve a webfont subset; the name is content-hashed so it never changes"""
+    try:
+        path = webfonts.path(filename)
+    except Exception as e:
+        print(f"Webfont build error for {filename}: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
+        return jsonify({'success': False, 'error': f'Webfont build failed: {str(e)}'}), 500
+    if path is None:
+        return jsonify({'success': False, 'error': 'Unknown webfont'}), 404
+    
+    ext = os.path.splitext(filename)[1].lstrip('.')
+    response = send_file(path, mimetype=f'font/{ext}', conditional=True, max_age=365 * 24 * 3600)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def reload_fonts():
+    """Rebuild the font catalog and drop everything derived from the old one"""
+    font_registry.invalidate()
+    pdf_fonts.clear()
+    layout_cache.clear()
+    # Keys include the font fingerprint, so old renders can no longer be hit;
+    # drop them from memory and leave the shared disk cache to evict by size
+    render_cache.clear()
+
+@app.route('/fonts/refresh', methods=['POST'])
+def refresh_fonts():
+    """Rescan the font directory after fonts are added or removed"""
+    reload_fonts()
+    return jsonify({'success': True, 'stats': font_registry.stats()})
 
 @app.route('/fonts')
 def get_fonts():
-    """Get available fonts"""
-    fonts = []
-    font_dir = 'static/fonts'
-    
-    # Add default fonts
-    fonts.extend(card_generator.default_fonts)
-    
-    # Add custom fonts
-    if os.path.exists(font_dir):
-        for file in os.listdir(font_dir):
-            if file.endswith('.ttf') or file.endswith('.otf'):
-                font_name = os.path.splitext(file)[0]
-                if font_name not in fonts:
-                    fonts.append(font_name)
-    
-    return jsonify(fonts)
+    """Font catalog: installed fonts with family, weight and Urdu/Arabic coverage
+    
+    Only fonts that can actually be loaded are listed. The response is
+    revalidated with an ETag that changes whenever the font files do.
+    """
+    if font_registry.changed():
+        reload_fonts()
+    
+    etag = font_registry.fingerprint
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        fallback = font_registry.fallback_path
+        response = jsonify({
+            'fonts': font_registry.catalog(),
+            'default': next((font['family'] for font in font_registry.catalog()
+                             if fallback and font['file'] == os.path.basename(fallback)), None),
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 if __name__ == '__main__':
     import os
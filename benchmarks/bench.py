@@ -0,0 +1,291 @@
+"""Offline benchmarks for the render and export hot paths
+
+Each case runs in a forked child process, so its peak RSS is its own. It
+gets one untimed warm-up run and then --repeat timed runs. The render,
+layout and loaded-font caches are cleared before every run, so each one
+does the full work. Results (median wall time, peak RSS, output bytes) are
+printed and can be saved as a JSON baseline. Later runs compare against the
+baseline and exit with status 1 when a case gets slower, bigger or hungrier
+than the thresholds allow.
+
+    python benchmarks/bench.py                      # compare with benchmarks/baseline.json
+    python benchmarks/bench.py --save               # record a new baseline
+    python benchmarks/bench.py --only preview --repeat 10
+    FONT_DIR=/path/to/fonts python benchmarks/bench.py --max-pixels 600000000
+
+Baselines are machine specific. Record one on the machine that will run the
+comparison, with the same FONT_DIR.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The shared disk cache would turn repeated runs into cache hits
+os.environ['DISK_CACHE_DIR'] = ''
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from PIL import Image  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+URDU_LINE = 'نمونہ متن - خوش آمدید'
+CARD = {
+    'text': f'{URDU_LINE}\nSample Text',
+    'width': 100,
+    'height': 70,
+    'font_size': 24,
+    'font_color': '#000000',
+    'bg_color': '#FFFFFF',
+    'alignment': 'center',
+    'line_spacing': 5,
+    'font_family': 'Noto Nastaliq Urdu',
+}
+REQUEST_CARD = {'text': CARD['text'], 'width': 100, 'height': 70, 'fontSize': 24,
+                'alignment': 'center'}
+
+
+def reset_caches():
+    """Make the next run do all of its work again"""
+    app.render_cache.clear()
+    app.layout_cache.clear()
+    app.font_registry.invalidate()
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def card_image(dpi, size):
+    def run():
+        img = app.card_generator.create_card_image(dpi=dpi, **dict(CARD, width=size[0], height=size[1]))
+        return img.width * img.height * len(img.getbands())
+    return run
+
+
+def pdf(lines):
+    def run():
+        text = '\n'.join(f'{URDU_LINE} {i}' for i in range(lines))
+        return len(app.card_generator.create_pdf(**dict(CARD, text=text)).getvalue())
+    return run
+
+
+def get_font():
+    # A different size per call keeps the loaded-font LRU from answering
+    sizes = iter(range(12, 100000))
+
+    def run():
+        app.card_generator.get_font(CARD['font_family'], next(sizes))
+        return 0
+    return run
+
+
+def route(path, **kwargs):
+    client = app.app.test_client()
+
+    def run():
+        response = client.post(path, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+        return len(response.get_data())
+    return run
+
+
+def merge_rows():
+    """Mail-merge rows through the cached static layer, checked against rendering from scratch"""
+    template = app.CardTemplate(dict(CARD, text=f'{URDU_LINE}\n{{name}}\nSample Text'), dpi=150)
+    rows = [{'name': name} for name in ('Ali', 'Ali\nKhan', 'Ali\r\nKhan', 'Ali\rKhan', '')]
+
+    def run():
+        output = 0
+        for row in rows:
+            image = template.render_image(row)
+            expected = app.card_generator.create_card_image(dpi=150, **template.row_params(row))
+            if image.tobytes() != expected.tobytes():
+                raise RuntimeError(f'template render of {row!r} differs from rendering from scratch')
+            output += len(image.tobytes())
+        return output
+    return run
+
+
+def canvas_upload():
+    """A canvas-pro sized PNG upload for /export_pdf (100x70 mm at 300 dpi)"""
+    image = app.card_generator.create_card_image(dpi=300, **CARD)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    data = buffer.getvalue()
+
+    def run():
+        return route('/export_pdf', data={'canvas': (io.BytesIO(data), 'canvas.png'),
+                                          'width': '100', 'height': '70', 'dpi': '300'},
+                     content_type='multipart/form-data')()
+    return run
+
+
+def cases(max_pixels):
+    """(name, factory or None if skipped, note)"""
+    yield 'get_font', get_font, ''
+    for label, size in (('small', (100, 70)), ('max', (500, 500))):
+        for dpi in (150, 300, 600, 1200):
+            pixels = int(size[0] * dpi / 25.4) * int(size[1] * dpi / 25.4)
+            name = f'create_card_image_{label}_{dpi}dpi'
+            if pixels > max_pixels:
+                yield name, None, f'{pixels / 1e6:.0f} MP is over --max-pixels'
+            else:
+                yield name, lambda dpi=dpi, size=size: card_image(dpi, size), ''
+    yield 'create_pdf_1_line', lambda: pdf(1), ''
+    yield 'create_pdf_100_lines', lambda: pdf(100), ''
+    yield 'merge_rows', merge_rows, ''
+    yield 'route_preview_json', lambda: route('/preview', json=REQUEST_CARD), ''
+    yield 'route_preview_png', lambda: route('/preview', json=REQUEST_CARD,
+                                             headers={'Accept': 'image/png'}), ''
+    yield 'route_export_jpg', lambda: route('/export/jpg', json=REQUEST_CARD), ''
+    yield 'route_export_pdf', lambda: route('/export/pdf', json=REQUEST_CARD), ''
+    yield 'route_export_canvas_pdf', canvas_upload, ''
+
+
+def measure(factory, repeat, conn):
+    """Child process body: warm up, time `repeat` runs and report back"""
+    # The app logs every request; keep the report readable
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        run = factory()
+        reset_caches()
+        run()
+        start_rss = rss_bytes()
+        timings = []
+        output = 0
+        for _ in range(repeat):
+            reset_caches()
+            started = time.perf_counter()
+            output = run()
+            timings.append(time.perf_counter() - started)
+        conn.send({
+            'seconds': statistics.median(timings),
+            'min_seconds': min(timings),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'rss_growth_mb': max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start_rss) / 2 ** 20,
+            'output_bytes': output,
+        })
+    except Exception as e:
+        conn.send({'error': f'{type(e).__name__}: {e}'})
+    finally:
+        conn.close()
+
+
+def run_case(factory, repeat):
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=measure, args=(factory, repeat, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': f'benchmark process died (exit code {process.join() or process.exitcode})'}
+    process.join()
+    return result
+
+
+def compare(results, baseline, args):
+    """Regressions of results against a baseline, as messages"""
+    failures = []
+    limits = (('seconds', args.time_threshold), ('peak_rss_mb', args.rss_threshold),
+              ('output_bytes', args.bytes_threshold))
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before or 'error' in result or 'error' in before or 'skipped' in result or 'skipped' in before:
+            continue
+        for metric, threshold in limits:
+            old, new = before.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + threshold):
+                failures.append(f'{name}: {metric} {old:.4g} -> {new:.4g} '
+                                f'(+{(new / old - 1) * 100:.0f}%, limit +{threshold * 100:.0f}%)')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare with or save to')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case (median is reported)')
+    parser.add_argument('--only', default='', help='run only cases whose name contains this')
+    parser.add_argument('--max-pixels', type=int, default=150_000_000,
+                        help='skip card sizes above this many pixels (500x500 mm at 1200 dpi is 558 MP)')
+    parser.add_argument('--time-threshold', type=float, default=0.25, help='allowed wall time increase')
+    parser.add_argument('--rss-threshold', type=float, default=0.25, help='allowed peak RSS increase')
+    parser.add_argument('--bytes-threshold', type=float, default=0.10, help='allowed output size increase')
+    args = parser.parse_args()
+
+    # Decompression bomb checks would reject the largest cards' uploads
+    Image.MAX_IMAGE_PIXELS = None
+
+    results = {}
+    for name, factory, note in cases(args.max_pixels):
+        if args.only and args.only not in name:
+            continue
+        if factory is None:
+            results[name] = {'skipped': note}
+            print(f'{name:34} skipped ({note})')
+            continue
+        result = run_case(factory, max(1, args.repeat))
+        results[name] = result
+        if 'error' in result:
+            print(f'{name:34} ERROR {result["error"]}')
+        else:
+            print(f'{name:34} {result["seconds"] * 1000:10.1f} ms {result["peak_rss_mb"]:9.1f} MB peak '
+                  f'{result["output_bytes"]:12,} bytes')
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': Image.__version__,
+            'reportlab': __import__('reportlab').Version,
+            'platform': platform.platform(),
+            'font_dir': app.FONT_DIR,
+            'fonts': app.font_registry.fingerprint,
+            'repeat': args.repeat,
+            'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+    errors = [name for name, result in results.items() if 'error' in result]
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        return 1 if errors else 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save to record one')
+        return 1 if errors else 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('fonts') != report['meta']['fonts']:
+        print('Warning: the baseline was recorded with different fonts')
+    failures = compare(results, baseline, args)
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    if errors:
+        print(f'{len(errors)} case(s) failed: {", ".join(errors)}')
+    if not failures and not errors:
+        print('No regressions against the baseline')
+    return 1 if failures or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
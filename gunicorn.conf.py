@@ -0,0 +1,28 @@
+"""Gunicorn settings: load and warm the app once in the master, then fork workers
+
+Workers share the parsed fonts and imported modules copy-on-write, so the
+first preview a new worker serves is not slowed by font loading. Set
+GUNICORN_PRELOAD=0 to load the app separately in each worker instead.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() not in ('0', 'false', 'no')
+
+# A sync worker is killed when one request runs past `timeout`. Streamed batch
+# and merge exports stop rendering at 80% of it (SYNC_EXPORT_SECONDS in app.py
+# reads the same variable) so their ZIPs are always finished.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, before any fork
+    if preload_app:
+        import app
+        app.warm_up()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.mark_worker_started()
@@ -50,14 +50,19 @@ class UrduCanvasEditorPro {
             'Markazi Text'
         ];
         
-        for (const font of fonts) {
+        // Paint right away with whatever is available, then again once
+        // the fonts (loaded in parallel) arrive
+        this.updateCanvas();
+        await Promise.all(fonts.map(async (font) => {
             try {
-                await document.fonts.load(`400 16px "${font}"`);
-                await document.fonts.load(`700 16px "${font}"`);
+                await Promise.all([
+                    document.fonts.load(`400 16px "${font}"`),
+                    document.fonts.load(`700 16px "${font}"`)
+                ]);
             } catch (e) {
                 console.log(`Font ${font} failed to load`);
             }
-        }
+        }));
         this.updateCanvas();
     }
 
@@ -317,6 +322,7 @@ class UrduCanvasEditorPro {
         // Export buttons
         document.getElementById('exportJpg').addEventListener('click', () => this.exportAsJPG());
         document.getElementById('exportPdf').addEventListener('click', () => this.exportAsPDF());
+        document.getElementById('exportVectorPdf')?.addEventListener('click', () => this.exportAsVectorPDF());
         
         // Canvas size controls
         document.getElementById('cardWidth').addEventListener('input', () => this.updateCanvasSize());
@@ -786,18 +792,17 @@ class UrduCanvasEditorPro {
             this.selectedElement = originalSelected;
             this.updateCanvas();
             
-            // Convert to base64 for server processing
-            const canvasData = exportCanvas.toDataURL('image/png');
+            // Upload as a binary JPEG; the server embeds it without re-encoding
+            const canvasBlob = await new Promise(resolve => exportCanvas.toBlob(resolve, 'image/jpeg', 0.95));
+            const formData = new FormData();
+            formData.append('canvas', canvasBlob, 'canvas.jpg');
+            formData.append('width', width);
+            formData.append('height', height);
+            formData.append('dpi', exportDpi);
             
             const response = await fetch('/export_pdf', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    canvas_data: canvasData,
-                    width: width,
-                    height: height,
-                    dpi: exportDpi
-                })
+                body: formData
             });
             
             if (response.ok) {
@@ -822,6 +827,50 @@ class UrduCanvasEditorPro {
         }
     }
 
+    getSceneDescription() {
+        return {
+            width: parseInt(document.getElementById('cardWidth').value),
+            height: parseInt(document.getElementById('cardHeight').value),
+            backgroundColor: document.getElementById('backgroundColor').value,
+            sceneDpi: 600, // Display canvas resolution, see updateCanvasSize
+            textElements: this.textElements
+        };
+    }
+
+    async exportAsVectorPDF() {
+        this.showLoading(true);
+        
+        try {
+            // Send the scene description; the server renders the text as vectors
+            const scene = this.getSceneDescription();
+            const response = await fetch('/export/scene', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ...scene, format: 'pdf' })
+            });
+            
+            if (response.ok) {
+                const blob = await response.blob();
+                const url = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = `urdu-card-${scene.width}x${scene.height}mm.pdf`;
+                a.click();
+                window.URL.revokeObjectURL(url);
+                
+                this.showNotification('Vector PDF exported successfully!');
+            } else {
+                const errorText = await response.text();
+                throw new Error(`Server error: ${errorText}`);
+            }
+        } catch (error) {
+            console.error('Vector PDF export error:', error);
+            this.showNotification('PDF export failed. Please try again.', 'error');
+        } finally {
+            this.showLoading(false);
+        }
+    }
+
     renderTextElementOnContext(ctx, element, scaleFactor = 1) {
         ctx.save();
         
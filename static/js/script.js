@@ -17,6 +17,7 @@ class UrduCardGenerator {
     this.fontFamily = document.getElementById("fontFamily");
     this.fontSize = document.getElementById("fontSize");
     this.fontSizeValue = document.getElementById("fontSizeValue");
+    this.autoFit = document.getElementById("autoFit");
     this.fontColor = document.getElementById("fontColor");
     this.alignment = document.getElementById("alignment");
 
@@ -40,6 +41,12 @@ class UrduCardGenerator {
     // Slider value updates
     this.fontSize.addEventListener("input", () => this.updateSliderValues());
     this.lineSpacing.addEventListener("input", () => this.updateSliderValues());
+    this.autoFit.addEventListener("change", () => {
+      // The server picks the size while auto-fit is on
+      this.fontSize.disabled = this.autoFit.checked;
+      this.updateSliderValues();
+      this.generatePreview();
+    });
 
     // Dimension updates
     this.cardWidth.addEventListener("input", () => this.updateDimensions());
@@ -98,7 +105,9 @@ class UrduCardGenerator {
   }
 
   updateSliderValues() {
-    this.fontSizeValue.textContent = `${this.fontSize.value}px`;
+    this.fontSizeValue.textContent = this.autoFit.checked
+      ? `${this.fittedFontSize || this.fontSize.value}px (auto)`
+      : `${this.fontSize.value}px`;
     this.lineSpacingValue.textContent = `${this.lineSpacing.value}px`;
   }
 
@@ -143,18 +152,31 @@ class UrduCardGenerator {
   async loadAvailableFonts() {
     try {
       const response = await fetch("/fonts");
-      const fonts = await response.json();
+      const catalog = await response.json();
+      const selected = this.fontFamily.value;
+
+      // One option per family; the server picks the nearest weight
+      const families = new Map();
+      catalog.fonts.forEach((font) => {
+        const known = families.get(font.family);
+        families.set(font.family, Math.max(known || 0, font.urdu));
+      });
+      if (families.size === 0) return;
 
       // Clear existing options
       this.fontFamily.innerHTML = "";
 
       // Add fonts to select
-      fonts.forEach((font) => {
+      families.forEach((urdu, family) => {
         const option = document.createElement("option");
-        option.value = font;
-        option.textContent = font;
+        option.value = family;
+        option.textContent = urdu < 0.9 ? `${family} (limited Urdu)` : family;
         this.fontFamily.appendChild(option);
       });
+
+      this.fontFamily.value = families.has(selected)
+        ? selected
+        : catalog.default || this.fontFamily.options[0].value;
     } catch (error) {
       console.error("Error loading fonts:", error);
     }
@@ -180,9 +202,18 @@ class UrduCardGenerator {
         Math.min(50, parseInt(this.lineSpacing.value) || 5)
       ),
       fontFamily: this.fontFamily.value || "Noto Nastaliq Urdu",
+      autoFit: this.autoFit.checked,
     };
   }
 
+  showFittedFontSize(fontSize) {
+    // Auto-fit previews report the size the server chose
+    if (!this.autoFit.checked || !fontSize) return;
+    this.fittedFontSize = parseInt(fontSize);
+    this.fontSize.value = Math.max(8, Math.min(72, this.fittedFontSize));
+    this.updateSliderValues();
+  }
+
   showLoading(show = true) {
     this.loadingOverlay.style.display = show ? "flex" : "none";
 
@@ -196,7 +227,79 @@ class UrduCardGenerator {
     });
   }
 
+  async fetchPreview(cardData, tier) {
+    // Drafts are sized to the preview box in device pixels
+    const scale = window.devicePixelRatio || 1;
+    // The last preview of each tier is revalidated rather than downloaded again
+    this.previewCache = this.previewCache || {};
+    const cached = this.previewCache[tier];
+    const headers = {
+      "Content-Type": "application/json",
+      Accept: "image/png, image/webp;q=0.9, application/json;q=0.5",
+    };
+    if (cached && cached.etag) {
+      headers["If-None-Match"] = cached.etag;
+    }
+    const response = await fetch("/preview", {
+      method: "POST",
+      headers,
+      body: JSON.stringify({
+        ...cardData,
+        tier,
+        viewportWidth: Math.round(this.cardPreview.clientWidth * scale),
+        viewportHeight: Math.round(this.cardPreview.clientHeight * scale),
+      }),
+    });
+
+    if (response.status === 304 && cached) {
+      // Unchanged: reuse the image already downloaded
+      this.showFittedFontSize(cached.fontSize);
+      return cached;
+    }
+
+    const contentType = response.headers.get("Content-Type") || "";
+    let preview;
+
+    if (response.ok && contentType.startsWith("image/")) {
+      // Binary preview: shown through an object URL
+      preview = {
+        url: URL.createObjectURL(await response.blob()),
+        objectUrl: true,
+        fontSize: response.headers.get("X-Fit-Font-Size"),
+      };
+    } else {
+      const result = await response.json();
+      if (!response.ok || !result.success) {
+        throw new Error(
+          result.error || result.message || "Preview generation failed"
+        );
+      }
+      preview = { url: result.image, objectUrl: false, fontSize: result.fontSize };
+    }
+
+    this.showFittedFontSize(preview.fontSize);
+    this.cachePreview(tier, preview, response.headers.get("ETag"));
+    return preview;
+  }
+
+  cachePreview(tier, preview, etag) {
+    // The cache owns object URLs; free the one this preview replaces
+    const previous = this.previewCache[tier];
+    if (previous && previous.objectUrl && previous.url !== preview.url) {
+      URL.revokeObjectURL(previous.url);
+    }
+    this.previewCache[tier] = { ...preview, etag };
+  }
+
+  showPreviewImage(preview) {
+    this.cardPreview.innerHTML = `<img src="${preview.url}" alt="Card Preview" style="max-width: 100%; max-height: 100%; object-fit: contain;">`;
+  }
+
   async generatePreview() {
+    // Responses for superseded previews are discarded
+    const sequence = (this.previewSequence = (this.previewSequence || 0) + 1);
+    const isCurrent = () => sequence === this.previewSequence;
+
     try {
       const cardData = this.getCardData();
 
@@ -209,36 +312,27 @@ class UrduCardGenerator {
       // Show loading
       this.showLoading(true);
 
-      // Update preview placeholder
-      this.cardPreview.innerHTML =
-        '<div class="preview-placeholder">Generating preview...</div>';
-
-      const response = await fetch("/preview", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify(cardData),
-      });
-
-      const result = await response.json();
+      // A fast low-DPI draft first, then the full-fidelity preview
+      const draft = await this.fetchPreview(cardData, "draft");
+      if (!isCurrent()) return;
+      this.showPreviewImage(draft);
+      this.showLoading(false);
 
-      if (response.ok && result.success) {
-        this.cardPreview.innerHTML = `<img src="${result.image}" alt="Card Preview" style="max-width: 100%; max-height: 100%; object-fit: contain;">`;
-        this.showNotification("Preview generated successfully!", "success");
-      } else {
-        const errorMsg =
-          result.error || result.message || "Preview generation failed";
-        this.cardPreview.innerHTML = `<div class="preview-placeholder error">Error: ${errorMsg}</div>`;
-        this.showNotification(errorMsg, "error");
-      }
+      const full = await this.fetchPreview(cardData, "full");
+      if (!isCurrent()) return;
+      this.showPreviewImage(full);
+      this.showNotification("Preview generated successfully!", "success");
     } catch (error) {
       console.error("Preview error:", error);
-      this.cardPreview.innerHTML =
-        '<div class="preview-placeholder error">Network error. Please check your connection.</div>';
-      this.showNotification("Network error. Please try again.", "error");
+      if (!isCurrent()) return;
+      const errorMsg =
+        error instanceof TypeError
+          ? "Network error. Please check your connection."
+          : error.message;
+      this.cardPreview.innerHTML = `<div class="preview-placeholder error">Error: ${errorMsg}</div>`;
+      this.showNotification(errorMsg, "error");
     } finally {
-      this.showLoading(false);
+      if (isCurrent()) this.showLoading(false);
     }
   }
 